@@ -0,0 +1,62 @@
+# auth_cache.py
+import hashlib, time
+from collections import OrderedDict
+
+
+class PrincipalCache:
+    """
+    Validated users keyed by (a hash of) their bearer token.
+    Entries expire after `ttl` seconds or at the token's own expiry, whichever
+    is first, and can be dropped per user when their record changes.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (user, expires_at)
+        self._by_email = {}            # email -> set of keys
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token, user, token_exp=None):
+        key = self._key(token)
+        expires_at = time.time() + self.ttl
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+        self._entries[key] = (user, expires_at)
+        self._entries.move_to_end(key)
+        self._by_email.setdefault(user["email"], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, email):
+        """Forget every cached token of this user (call after any change to their record)."""
+        for key in self._by_email.pop(email, ()):
+            self._entries.pop(key, None)
+
+    def _remove(self, key):
+        user, _ = self._entries.pop(key)
+        keys = self._by_email.get(user["email"])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._by_email[user["email"]]
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
@@ -0,0 +1,233 @@
+# benchmark.py
+"""
+Offline end-to-end pipeline benchmark.
+
+Replays PatientSimulator vignettes through doctor_reply -> extract_structured ->
+evaluate_triage -> verify against an in-process stub Ollama with configurable
+latency, and prints one JSON report (per-stage p50/p95/p99, throughput, peak memory).
+
+    python benchmark.py -n 500 -c 16 --latency-ms 200 --jitter-ms 50 --out bench.json
+"""
+import argparse, asyncio, json, math, os, random, re, socket, subprocess, sys, threading, time, tracemalloc
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+STAGES = ("doctor_reply", "extract_structured", "evaluate_triage", "verify", "total")
+
+
+# -----------------------------
+# Stub Ollama
+# -----------------------------
+def _stub_response(payload):
+    """Fake /api/generate body: a JSON record for extraction prompts, a short question otherwise."""
+    prompt = payload.get("prompt", "")
+    if payload.get("format") == "json":
+        complaint = re.search(r"Chief Complaint: (.*)", prompt)
+        vitals = re.search(r"Vitals: (\{.*\})", prompt)
+        symptoms = re.search(r"Symptoms: (.*)", prompt)
+        text = json.dumps({
+            "chief_complaint": complaint.group(1).strip() if complaint else "",
+            "onset": "", "severity": "moderate",
+            "associated_symptoms": [s.strip() for s in symptoms.group(1).split(",") if s.strip()] if symptoms else [],
+            "risk_factors": [],
+            "vitals": json.loads(vitals.group(1)) if vitals else {},
+        })
+    else:
+        text = "I understand. How long have you had these symptoms? Any other changes you've noticed?"
+    return {"model": payload.get("model"), "response": text, "done": True,
+            "prompt_eval_count": len(prompt) // 4, "eval_count": len(text) // 4}
+
+
+class StubOllama:
+    """Minimal keep-alive HTTP server on its own thread + loop, so it doesn't share the benchmark's loop."""
+
+    def __init__(self, latency_ms=200, jitter_ms=0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = random.Random(seed)
+        self.requests = 0
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True).start()
+        self._ready.wait()
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = int(re.search(rb"(?i)content-length: *(\d+)", head).group(1)) if b"ength" in head else 0
+                payload = json.loads(await reader.readexactly(length)) if length else {}
+                self.requests += 1
+                delay = max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+                await asyncio.sleep(delay)
+                body = json.dumps(_stub_response(payload)).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# -----------------------------
+# Measurement helpers
+# -----------------------------
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def load_cases(n, num_turns, seed):
+    """n scripted conversations, sampled from the vignette store (generated ones if it's empty)."""
+    from patient_simulator import PatientSimulator
+    random.seed(seed)
+    sim = PatientSimulator()
+    if len(sim.store) > n:
+        pool = sim.store.sample(n, rng=random.Random(seed))
+    else:
+        pool = list(sim.store) or [sim.generate_patient() for _ in range(min(n, 100))]
+    return [sim.build_conversation(pool[i % len(pool)], num_turns) for i in range(n)]
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+async def run_pipeline(cases, concurrency):
+    from doctor_agent import doctor_reply
+    from symptom_extractor import extract_structured
+    from triage_engine import evaluate_triage
+    from guideline_verifier import verify
+    import llm_client
+
+    timings = {s: [] for s in STAGES}
+    levels, errors = {}, 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(conversation_text, history):
+        nonlocal errors
+        async with gate:
+            t0 = time.perf_counter()
+            try:
+                await doctor_reply(history)
+                t1 = time.perf_counter()
+                structured = await extract_structured(conversation_text)
+                t2 = time.perf_counter()
+                triage = evaluate_triage(structured)
+                t3 = time.perf_counter()
+                terms = [str(x) for x in [structured.get("chief_complaint")] +
+                         list(structured.get("associated_symptoms") or []) if x]
+                triage = verify(triage, terms)
+                t4 = time.perf_counter()
+            except Exception as e:
+                errors += 1
+                print(f"❌ Benchmark case failed: {e}", file=sys.stderr)
+                return
+            for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t4 - t0)):
+                timings[stage].append(elapsed)
+            levels[triage["level"]] = levels.get(triage["level"], 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(text, history) for text, history in cases))
+    wall = time.perf_counter() - start
+    scheduler = llm_client.stats()
+    await llm_client.aclose()
+    return timings, levels, errors, wall, scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark over PatientSimulator vignettes")
+    parser.add_argument("-n", "--cases", type=int, default=200, help="conversations to replay")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="conversations in flight")
+    parser.add_argument("--turns", type=int, default=3, help="doctor/patient follow-up pairs per conversation")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="stub LLM latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter on the stub latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="replay once more, untimed, under tracemalloc for the Python peak")
+    args = parser.parse_args(argv)
+
+    stub = StubOllama(args.latency_ms, args.jitter_ms, args.seed)
+    stub.start()
+    # the agents read OLLAMA_URL at import time, so point them at the stub first
+    os.environ["OLLAMA_URL"] = stub.url
+
+    cases = load_cases(args.cases, args.turns, args.seed)
+    timings, levels, errors, wall, scheduler = asyncio.run(run_pipeline(cases, args.concurrency))
+    llm_requests = stub.requests
+
+    maxrss_bytes = None
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        maxrss_bytes = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    # tracing slows every allocation, so it never runs during the timed pass
+    peak_traced = None
+    if args.trace_memory:
+        tracemalloc.start()
+        asyncio.run(run_pipeline(cases, args.concurrency))
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": vars(args),
+        "llm_max_concurrency": scheduler["max_concurrency"],
+        "completed": len(timings["total"]),
+        "errors": errors,
+        "llm_requests": llm_requests,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(timings["total"]) / wall, 3) if wall else None,
+        "stages": {s: summarize(v) for s, v in timings.items()},
+        "triage_levels": levels,
+        "peak_memory": {"python_traced_bytes": peak_traced, "max_rss_bytes": maxrss_bytes},
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
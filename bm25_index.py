@@ -0,0 +1,177 @@
+# bm25_index.py
+"""
+Offline BM25 index over the medical encyclopedia, stored as one flat binary
+file that workers memory-map instead of loading.
+
+Build once:
+    python bm25_index.py data/<encyclopedia>.pdf data/guidelines_bm25.idx
+
+File layout (little-endian):
+    header      MAGIC, n_docs, n_terms (uint32), avgdl (float64)
+    term_offs   uint64[n_terms + 1]   -> into term_blob (terms sorted bytewise)
+    post_offs   uint64[n_terms + 1]   -> into postings, counted in entries
+    doc_lens    uint32[n_docs]
+    text_offs   uint64[n_docs + 1]    -> into text_blob
+    postings    uint32 doc ids, then uint16 term freqs (same order)
+    term_blob   utf-8 terms
+    text_blob   utf-8 passages
+"""
+import heapq, math, mmap, os, re, struct, sys
+from array import array
+from collections import Counter, defaultdict
+
+MAGIC = b"BM25IDX1"
+_HEADER = struct.Struct("<8sIId")
+K1, B = 1.5, 0.75
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were
+will with not no but if then than so such can may also which who whom what when where how
+""".split())
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def chunk_text(text, chunk_size=800, overlap=100):
+    """Split text into ~chunk_size character passages on word boundaries, with overlap."""
+    words = text.split()
+    chunks, current, length = [], [], 0
+    for w in words:
+        if current and length + len(w) + 1 > chunk_size:
+            chunks.append(" ".join(current))
+            # carry the tail of the previous chunk over for context
+            tail, tail_len = [], 0
+            for prev in reversed(current):
+                if tail_len + len(prev) + 1 > overlap:
+                    break
+                tail.insert(0, prev)
+                tail_len += len(prev) + 1
+            current, length = tail, tail_len
+        current.append(w)
+        length += len(w) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def pdf_passages(pdf_path, chunk_size=800, overlap=100):
+    import pdfplumber  # offline-only dependency
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            yield from chunk_text(text, chunk_size, overlap)
+
+
+def build_index(passages, out_path):
+    """Write a BM25 index for an iterable of passage strings. Returns the passage count."""
+    postings = defaultdict(list)  # term -> [(doc_id, tf)]
+    doc_lens, texts = array("I"), []
+    for doc_id, passage in enumerate(passages):
+        tokens = tokenize(passage)
+        doc_lens.append(len(tokens))
+        texts.append(passage.encode("utf-8"))
+        for term, tf in Counter(tokens).items():
+            postings[term].append((doc_id, min(tf, 0xFFFF)))
+
+    terms = sorted(t.encode("utf-8") for t in postings)
+    n_docs, n_terms = len(doc_lens), len(terms)
+    avgdl = (sum(doc_lens) / n_docs) if n_docs else 0.0
+
+    term_offs, post_offs, text_offs = array("Q", [0]), array("Q", [0]), array("Q", [0])
+    doc_ids, tfs = array("I"), array("H")
+    for t in terms:
+        term_offs.append(term_offs[-1] + len(t))
+        plist = postings[t.decode("utf-8")]
+        doc_ids.extend(d for d, _ in plist)
+        tfs.extend(f for _, f in plist)
+        post_offs.append(len(doc_ids))
+    for t in texts:
+        text_offs.append(text_offs[-1] + len(t))
+
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, n_docs, n_terms, avgdl))
+        for arr in (term_offs, post_offs, doc_lens, text_offs, doc_ids, tfs):
+            arr.tofile(f)
+        f.write(b"".join(terms))
+        f.write(b"".join(texts))
+    os.replace(tmp, out_path)  # readers never see a half-written index
+    return n_docs
+
+
+class BM25Index:
+    """Read-only, memory-mapped BM25 index. Pages are shared between worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.avgdl = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a BM25 index")
+
+        view, pos = memoryview(self._mm), _HEADER.size
+
+        def take(fmt, count):
+            nonlocal pos
+            size = struct.calcsize(fmt) * count
+            part = view[pos:pos + size].cast(fmt)
+            pos += size
+            return part
+
+        self._term_offs = take("Q", self.n_terms + 1)
+        self._post_offs = take("Q", self.n_terms + 1)
+        self._doc_lens = take("I", self.n_docs)
+        self._text_offs = take("Q", self.n_docs + 1)
+        n_postings = self._post_offs[-1]
+        self._doc_ids = take("I", n_postings)
+        self._tfs = take("H", n_postings)
+        self._terms = view[pos:pos + self._term_offs[-1]]
+        pos += self._term_offs[-1]
+        self._texts = view[pos:pos + self._text_offs[-1]]
+
+    def _term(self, i):
+        return self._terms[self._term_offs[i]:self._term_offs[i + 1]]
+
+    def _find(self, term):
+        """Binary search the sorted term table; returns the term index or -1."""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid).tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self._term(lo).tobytes() == key else -1
+
+    def passage(self, doc_id):
+        return self._texts[self._text_offs[doc_id]:self._text_offs[doc_id + 1]].tobytes().decode("utf-8")
+
+    def search(self, query, k=3):
+        """Top-k passages for `query` as [{"score", "doc_id", "text"}], best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            i = self._find(term)
+            if i < 0:
+                continue
+            start, end = self._post_offs[i], self._post_offs[i + 1]
+            df = end - start
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            for j in range(start, end):
+                doc, tf = self._doc_ids[j], self._tfs[j]
+                norm = K1 * (1 - B + B * self._doc_lens[doc] / self.avgdl)
+                scores[doc] += idf * tf * (K1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        return [{"score": round(s, 4), "doc_id": d, "text": self.passage(d)} for d, s in best]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python bm25_index.py <encyclopedia.pdf> <out.idx>")
+        sys.exit(1)
+    count = build_index(pdf_passages(sys.argv[1]), sys.argv[2])
+    print(f"✅ Indexed {count} passages into {sys.argv[2]}")
@@ -0,0 +1,86 @@
+# case_report.py
+import json
+import llm_client
+from symptom_extractor import LIST_FIELDS
+from utils import REPORT_MODEL_NAME
+
+# Summary, top-5 differential and structured record from one generation,
+# so the end-of-consultation transcript is prefilled once instead of three times.
+REPORT_INSTRUCTION = """
+You are a clinical documentation assistant. Read the doctor-patient conversation
+and return ONLY a JSON object with exactly these keys:
+- "summary": string — key symptoms, likely causes and recommended next steps, concise
+- "differential": array of the 5 most likely diagnoses, most likely first,
+  each {"diagnosis": string, "reasoning": one-line string}
+- "structured": object with
+    chief_complaint (string), onset (string), severity (string: mild/moderate/severe),
+    associated_symptoms (array of strings), risk_factors (array of strings),
+    vitals (object, e.g., {"hr": "80", "bp":"120/80", "temp":"37.0"})
+  use empty strings or empty lists/objects when the conversation doesn't say.
+No disclaimers.
+Conversation:
+"""
+
+DIFFERENTIAL_SIZE = 5
+
+
+def _dialogue(conversation):
+    return "\n".join(
+        [f"{m.get('role', 'unknown').capitalize()}: {m.get('message', '')}" for m in conversation]
+    )
+
+
+def _normalize(report):
+    """Coerce the model's JSON into the documented shape (missing parts become empty)."""
+    structured = report.get("structured") if isinstance(report.get("structured"), dict) else {}
+    structured = {
+        "chief_complaint": str(structured.get("chief_complaint") or ""),
+        "onset": str(structured.get("onset") or ""),
+        "severity": str(structured.get("severity") or ""),
+        **{f: [str(x) for x in structured.get(f) or [] if x] for f in LIST_FIELDS},
+        "vitals": structured.get("vitals") if isinstance(structured.get("vitals"), dict) else {},
+    }
+    differential = []
+    for item in report.get("differential") or []:
+        if isinstance(item, dict) and item.get("diagnosis"):
+            differential.append({"diagnosis": str(item["diagnosis"]).strip(),
+                                 "reasoning": str(item.get("reasoning") or "").strip()})
+        elif isinstance(item, str) and item.strip():
+            differential.append({"diagnosis": item.strip(), "reasoning": ""})
+    return {
+        "summary": str(report.get("summary") or "").strip(),
+        "differential": differential[:DIFFERENTIAL_SIZE],
+        "structured": structured,
+    }
+
+
+def format_differential(differential):
+    """Numbered "Disease — reasoning" lines, the same text the diagnosis agent returns."""
+    return "\n".join(
+        f"{i}. {d['diagnosis']} — {d['reasoning']}" if d["reasoning"] else f"{i}. {d['diagnosis']}"
+        for i, d in enumerate(differential, 1)
+    )
+
+
+async def generate_case_report(conversation):
+    """
+    Takes a list of messages (role + message) and returns
+    {"summary", "differential": [{"diagnosis", "reasoning"}], "structured"},
+    or {"error": "..."} when nothing usable came back.
+    """
+    try:
+        if not conversation or not isinstance(conversation, list):
+            return {"error": "No valid conversation to report on."}
+
+        prompt = REPORT_INSTRUCTION + "\n" + _dialogue(conversation) + "\n\nReturn JSON now:"
+        # the "report" profile sets format=json
+        data = await llm_client.generate(prompt, model=REPORT_MODEL_NAME, timeout=240, priority="report", agent="report")
+        report = _normalize(json.loads(data.get("response") or "{}"))
+
+        if not report["summary"] or not report["differential"]:
+            return {"error": "Incomplete case report generated."}
+        return report
+
+    except Exception as e:
+        print(f"❌ Case report generation error: {e}")
+        return {"error": f"Error generating case report: {e}"}
@@ -1,7 +1,11 @@
-import requests
-import json
+import httpx
+import llm_client
+from utils import REPORT_MODEL_NAME
 
-def generate_differential_diagnosis(conversation):
+# Replies that signal a failure rather than a diagnosis list (not worth caching)
+ERROR_PREFIXES = ("Ollama server not reachable", "No diagnoses generated", "Unable to generate")
+
+async def generate_differential_diagnosis(conversation):
     """
     Takes a list of conversation messages (role + message)
     and returns the top 5 possible diagnoses using Ollama.
@@ -27,26 +31,15 @@ Instructions:
 - Do NOT include disclaimers.
 """
 
-        payload = {
-            "model": "mistral:latest",
-            "prompt": prompt,
-            "stream": False
-        }
-
         # ✅ Step 3: Call Ollama
         try:
-            res = requests.post("http://localhost:11434/api/generate", json=payload, timeout=120)
-            res.raise_for_status()
-        except requests.exceptions.ConnectionError:
+            data = await llm_client.generate(prompt, model=REPORT_MODEL_NAME, timeout=120, priority="report", agent="diagnosis")
+        except httpx.ConnectError:
             print("❌ Ollama connection error — is Ollama running?")
             return "Ollama server not reachable. Please start it using `ollama serve`."
 
         # ✅ Step 4: Parse response safely
-        try:
-            data = res.json()
-            diagnosis_text = data.get("response", "") or data.get("text", "")
-        except json.JSONDecodeError:
-            diagnosis_text = res.text
+        diagnosis_text = data.get("response", "") or data.get("text", "")
 
         # ✅ Step 5: Handle empty results
         if not diagnosis_text.strip():
@@ -61,8 +61,12 @@
     
 #     return reply, end_convo
 # doctor_agent.py
-import requests
-from utils import OLLAMA_URL, MODEL_NAME
+import httpx
+import llm_client
+from utils import MODEL_NAME
+from contextlib import aclosing
+from array import array
+import hashlib
 import json
 import re
 
@@ -76,48 +80,49 @@ If a triage context is provided, respond with awareness of urgency.
 End the consultation with <END_CONVO> if the conversation feels complete.
 """
 
+END_TOKEN = "<END_CONVO>"
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?]) +')
+
 # -----------------------------
 # Core API Call with Safe Fallback
 # -----------------------------
-def _call_ollama(prompt, model=None, max_tokens=180):
+async def _call_ollama(prompt, model=None, context=None, full_prompt=None, priority="chat"):
     """
     Call the Ollama API safely with retry & fallback logic.
+    When `context` is given, `prompt` only holds the new turn and `full_prompt`
+    is used if the server rejects the cached context.
+    `priority` is the scheduler class ("emergency" for patients already triaged as such).
+    Returns (text, new_context, model_used).
     """
-    url = f"{OLLAMA_URL}/api/generate"
     model = model or MODEL_NAME
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "max_tokens": max_tokens,
-        "temperature": 0.25,
-        "stream": False
-    }
+    extra = {"context": list(context)} if context is not None else {}
 
     try:
-        r = requests.post(url, json=payload, timeout=180)
-        r.raise_for_status()
-        data = r.json()
-        return data.get("response", "").strip()
+        data = await llm_client.generate(
+            prompt, model=model, timeout=180, priority=priority, agent="doctor", **extra,
+        )
+        return data.get("response", "").strip(), data.get("context"), model
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Ollama connection error — Is `ollama serve` running?")
-        return "⚠️ The doctor AI is currently offline. Please start the model server."
+        return "⚠️ The doctor AI is currently offline. Please start the model server.", None, model
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         print(f"❌ Ollama returned HTTP error: {e}")
-        # Retry once with fallback model
-        if model != "mistral":
-            print("🔄 Retrying with fallback model: mistral")
-            return _call_ollama(prompt, model="mistral")
-        return "⚠️ Unable to generate a doctor reply. Please try again later."
+        # Cached context may be stale — rebuild the full prompt on the same model
+        # (node failures were already retried on other endpoints by llm_client's router)
+        if context is not None and full_prompt:
+            print("🔄 Retrying without cached context")
+            return await _call_ollama(full_prompt, model=model, priority=priority)
+        return "⚠️ Unable to generate a doctor reply. Please try again later.", None, model
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print("⏰ Ollama request timed out.")
-        return "⚠️ The doctor is taking too long to respond. Please try again."
+        return "⚠️ The doctor is taking too long to respond. Please try again.", None, model
 
     except Exception as e:
         print(f"❌ Unexpected error in _call_ollama: {e}")
-        return "⚠️ Something went wrong while contacting the AI model."
+        return "⚠️ Something went wrong while contacting the AI model.", None, model
 
 
 # -----------------------------
@@ -126,15 +131,60 @@ def _call_ollama(prompt, model=None, max_tokens=180):
 def _shorten_reply(text, max_sentences=4):
     if not text:
         return "I’m here to help — could you please describe your symptoms again?"
-    sentences = re.split(r'(?<=[.!?]) +', text.strip())
+    sentences = _SENTENCE_BREAK.split(text.strip())
     return " ".join(sentences[:max_sentences])
 
 
+def _finalize_reply(raw_reply):
+    """Shorten a raw model reply and strip the end token. Returns (reply, end_convo)."""
+    reply = _shorten_reply(raw_reply)
+
+    # Detect conversation end token
+    end_convo = END_TOKEN in reply
+    reply = reply.replace(END_TOKEN, "").strip()
+
+    # Default fallback if no meaningful text
+    if not reply or len(reply) < 5:
+        reply = "I'm here to help. Can you share more details about your symptoms?"
+
+    return reply, end_convo
+
+
+# -----------------------------
+# Helpers: Early cutoff while streaming
+# -----------------------------
+def _stream_cutoff(text, max_sentences=4):
+    """
+    Decide where a partially streamed reply should stop.
+    Returns (cut_index, end_convo); cut_index is None while generation should continue.
+    """
+    end_at = text.find(END_TOKEN)
+    for i, m in enumerate(_SENTENCE_BREAK.finditer(text), 1):
+        if i == max_sentences:
+            if end_at != -1 and end_at < m.start():
+                return end_at, True
+            return m.start(), False
+    if end_at != -1:
+        return end_at, True
+    return None, False
+
+
+def _safe_length(text):
+    """How much of text can be forwarded without leaking a partial <END_CONVO>."""
+    i = text.rfind("<")
+    if i != -1 and END_TOKEN.startswith(text[i:]):
+        return i
+    return len(text)
+
+
 # -----------------------------
 # Build Doctor Prompt
 # -----------------------------
-def build_prompt(message_history, triage_context=None):
-    prompt = SYSTEM_PROMPT + "\n\nThe following is a conversation between a doctor and a patient:\n\n"
+def build_prompt(message_history, triage_context=None, digest=None):
+    prompt = SYSTEM_PROMPT
+    if digest:
+        prompt += "\n" + digest + "\n"
+    prompt += "\n\nThe following is a conversation between a doctor and a patient:\n\n"
 
     for m in message_history:
         role = m.get("role", "user").capitalize()
@@ -148,29 +198,136 @@ def build_prompt(message_history, triage_context=None):
     return prompt
 
 
+def build_turn_prompt(new_messages, triage_context=None):
+    """Prompt for the new turn only, appended to a cached Ollama context."""
+    prompt = ""
+    for m in new_messages:
+        role = m.get("role", "user").capitalize()
+        content = m.get("content") or m.get("message") or ""
+        prompt += f"{role}: {content}\n"
+
+    if triage_context:
+        prompt += f"\nTriage context: {triage_context}\n"
+
+    prompt += "\nDoctor:"
+    return prompt
+
+
+# -----------------------------
+# Per-session Prompt Cache
+# -----------------------------
+# A cache is a plain dict owned by the session:
+#   {"context": array of token ids, "model": str, "turns": int, "fingerprint": str, "digest": str}
+# `context` is what Ollama returned after the last reply; it already contains the
+# system prompt and every message up to `turns`, so only newer messages are sent.
+def _fingerprint(messages):
+    h = hashlib.sha1()
+    for m in messages:
+        h.update(m.get("role", "").encode())
+        h.update(b"\0")
+        h.update((m.get("content") or m.get("message") or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _cached_prompt(cache, message_history, triage_context, model, digest=None):
+    """Return (prompt, context) reusing the cache when valid, else a full rebuild."""
+    full_prompt = build_prompt(message_history, triage_context, digest)
+    if (
+        cache
+        and cache.get("model") == model
+        and cache.get("digest") == digest
+        and 0 < cache.get("turns", 0) < len(message_history)
+        and cache.get("fingerprint") == _fingerprint(message_history[:cache["turns"]])
+    ):
+        return build_turn_prompt(message_history[cache["turns"]:], triage_context), cache["context"], full_prompt
+    return full_prompt, None, full_prompt
+
+
+def _update_cache(cache, message_history, raw_reply, reply, context, model, digest=None):
+    """Store Ollama's context only if it matches what the session will record."""
+    if cache is None:
+        return
+    cache.clear()
+    # A trimmed reply means the context holds text the patient never saw
+    if context and raw_reply.strip() == reply:
+        covered = list(message_history) + [{"role": "assistant", "content": reply}]
+        cache.update({
+            "context": array("i", context),
+            "model": model,
+            "turns": len(covered),
+            "fingerprint": _fingerprint(covered),
+            "digest": digest,
+        })
+
+
 # -----------------------------
 # Main Function: Doctor Reply
 # -----------------------------
-def doctor_reply(message_history, triage_context=None):
+async def doctor_reply(message_history, triage_context=None, cache=None, priority="chat", digest=None):
     """
     Generate a doctor reply using Ollama with safety and fallbacks.
+    Pass the session's `cache` dict to reuse Ollama's context between turns.
+    `digest` summarises turns left out of `message_history` (see history_manager.py).
     Returns (reply, end_convo_flag)
     """
     try:
-        prompt = build_prompt(message_history, triage_context)
-        raw_reply = _call_ollama(prompt)
-        reply = _shorten_reply(raw_reply)
-
-        # Detect conversation end token
-        end_convo = "<END_CONVO>" in reply
-        reply = reply.replace("<END_CONVO>", "").strip()
-
-        # Default fallback if no meaningful text
-        if not reply or len(reply) < 5:
-            reply = "I'm here to help. Can you share more details about your symptoms?"
-
+        prompt, context, full_prompt = _cached_prompt(cache, message_history, triage_context, MODEL_NAME, digest)
+        raw_reply, new_context, model = await _call_ollama(prompt, context=context, full_prompt=full_prompt,
+                                                          priority=priority)
+        reply, end_convo = _finalize_reply(raw_reply)
+        _update_cache(cache, message_history, raw_reply, reply, new_context, model, digest)
         return reply, end_convo
 
     except Exception as e:
         print(f"❌ Doctor agent error in doctor_reply(): {e}")
         return "⚠️ The doctor AI is currently unavailable. Please try again later.", False
+
+
+# -----------------------------
+# Streaming Variant
+# -----------------------------
+async def doctor_reply_stream(message_history, triage_context=None, max_sentences=4, cache=None,
+                              priority="chat", digest=None):
+    """
+    Stream a doctor reply as it is generated.
+    Yields {"type": "token", "text": ...} events, then a single
+    {"type": "done", "reply": ..., "end_convo": ...} with the cleaned reply.
+    The upstream generation is cancelled as soon as max_sentences or <END_CONVO> is reached.
+    """
+    prompt, context, _ = _cached_prompt(cache, message_history, triage_context, MODEL_NAME, digest)
+    extra = {"context": list(context)} if context is not None else {}
+    text, sent, cut, end_convo, new_context = "", 0, None, False, None
+
+    try:
+        stream = llm_client.stream_generate(
+            prompt, model=MODEL_NAME, timeout=180, priority=priority, agent="doctor", **extra,
+        )
+        async with aclosing(stream):
+            async for chunk in stream:
+                text = (text + chunk.get("response", "")).lstrip()
+                cut, end_convo = _stream_cutoff(text, max_sentences)
+                safe = cut if cut is not None else _safe_length(text)
+                if safe > sent:
+                    yield {"type": "token", "text": text[sent:safe]}
+                    sent = safe
+                if chunk.get("done"):
+                    new_context = chunk.get("context")
+                if cut is not None or chunk.get("done"):
+                    break
+
+    except Exception as e:
+        print(f"❌ Doctor agent error in doctor_reply_stream(): {e}")
+        if not sent:
+            if isinstance(e, httpx.ConnectError):
+                text = "⚠️ The doctor AI is currently offline. Please start the model server."
+            else:
+                text = "⚠️ The doctor AI is currently unavailable. Please try again later."
+            yield {"type": "token", "text": text}
+            cut = None
+
+    raw_reply = text if cut is None else text[:cut] + (END_TOKEN if end_convo else "")
+    reply, end_convo = _finalize_reply(raw_reply)
+    # an early cutoff never receives a context, which clears the cache
+    _update_cache(cache, message_history, raw_reply, reply, new_context, MODEL_NAME, digest)
+    yield {"type": "done", "reply": reply, "end_convo": end_convo}
@@ -21,6 +21,7 @@ export default function Chat() {
   const [toast, setToast] = useState("");
   const [isTyping, setIsTyping] = useState(false);
   const [chatHistory, setChatHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
   const [activeChat, setActiveChat] = useState(null);
   const [showSidebar, setShowSidebar] = useState(false);
   const [selectedSummary, setSelectedSummary] = useState(null);
@@ -28,18 +29,29 @@ export default function Chat() {
   const [showProfile, setShowProfile] = useState(false);
   const [userData, setUserData] = useState({});
   const inputRef = useRef(null);
+  const socketRef = useRef(null);
+  const escalatedTurn = useRef(null);
+  const sessionId = useRef("sess-" + Math.random().toString(36).slice(2, 9)).current;
   const token = localStorage.getItem("token");
 
   if (!token) navigate("/");
 
-  // ===== Fetch chat summaries =====
-  useEffect(() => {
-    fetch("http://127.0.0.1:8000/api/summaries", {
+  // ===== Fetch chat summaries (newest first, one page at a time) =====
+  const loadSummaries = (before = null) => {
+    const query = before ? `?before=${encodeURIComponent(before)}` : "";
+    fetch(`http://127.0.0.1:8000/api/summaries${query}`, {
       headers: { Authorization: `Bearer ${token}` },
     })
       .then((res) => res.json())
-      .then((data) => setChatHistory(data.history || []))
+      .then((data) => {
+        setChatHistory((prev) => (before ? [...prev, ...(data.history || [])] : data.history || []));
+        setHistoryCursor(data.next_cursor || null);
+      })
       .catch((err) => console.error("❌ Error fetching summaries:", err));
+  };
+
+  useEffect(() => {
+    loadSummaries();
   }, []);
 
   // ===== Fetch user details =====
@@ -52,6 +64,53 @@ export default function Chat() {
       .catch(() => console.log("⚠ Unable to fetch user profile"));
   }, []);
 
+  // ===== Chat socket: authenticated once, server pushes reply / triage / end frames =====
+  useEffect(() => {
+    let closed = false;
+    let retry = null;
+
+    const connect = () => {
+      const ws = new WebSocket("ws://127.0.0.1:8000/ws/chat");
+      ws.onopen = () => ws.send(JSON.stringify({ type: "auth", token }));
+      ws.onmessage = (event) => {
+        const frame = JSON.parse(event.data);
+        if (frame.session_id && frame.session_id !== sessionId) return;
+
+        if (frame.type === "ready") {
+          socketRef.current = ws;
+        } else if (frame.type === "escalation") {
+          // red flag in the message: shown before the doctor reply is generated
+          escalatedTurn.current = frame.turn;
+          appendMessage(frame.text, "bot");
+          if (frame.triage) showTriage(frame.triage);
+        } else if (frame.type === "reply") {
+          setIsTyping(false);
+          appendMessage(frame.reply || "No response received.", "bot");
+        } else if (frame.type === "triage") {
+          const shown = frame.turn === escalatedTurn.current && frame.triage?.level === "Emergency";
+          if (frame.triage && !shown) showTriage(frame.triage);
+        } else if (frame.type === "end_convo") {
+          showToast("✅ Consultation complete.");
+        } else if (frame.type === "error") {
+          setIsTyping(false);
+          appendMessage(`❌ ${frame.detail || "Failed to send message."}`, "bot");
+        }
+      };
+      ws.onclose = (event) => {
+        if (socketRef.current === ws) socketRef.current = null;
+        // 1008 = rejected token; anything else reconnects, HTTP is used meanwhile
+        if (!closed && event.code !== 1008) retry = setTimeout(connect, 3000);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (socketRef.current) socketRef.current.close();
+    };
+  }, []);
+
   // ===== Theme toggle effect =====
   useEffect(() => {
     document.body.className =
@@ -72,6 +131,12 @@ export default function Chat() {
     setInput("");
     setIsTyping(true);
 
+    const ws = socketRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ session_id: sessionId, message: input }));
+      return;
+    }
+
     try {
       const res = await fetch("http://127.0.0.1:8000/api/chat", {
         method: "POST",
@@ -80,31 +145,42 @@ export default function Chat() {
           Authorization: `Bearer ${token}`,
         },
         body: JSON.stringify({
-          session_id: "sess-" + Math.random().toString(36).slice(2, 9),
+          session_id: sessionId,
           message: input,
         }),
       });
 
       const data = await res.json();
-      setIsTyping(false);
 
+      if (data.escalation) {
+        // escalation advice now, the doctor reply follows
+        appendMessage(data.reply, "bot");
+        if (data.triage) showTriage(data.triage);
+        fetch(`http://127.0.0.1:8000/api/reply/${sessionId}?wait=30`, {
+          headers: { Authorization: `Bearer ${token}` },
+        })
+          .then((r) => r.json())
+          .then((d) => {
+            setIsTyping(false);
+            if (d.reply) appendMessage(d.reply, "bot");
+          })
+          .catch(() => setIsTyping(false));
+        return;
+      }
+
+      setIsTyping(false);
       appendMessage(data.reply || "No response received.", "bot");
 
-      // ===== TRIAGE BADGE (KEEP ORIGINAL FUNCTIONALITY) =====
+      // Triage is computed in the background; fetch it if it wasn't ready yet
       if (data.triage) {
-        let badgeClass =
-          data.triage.level.toLowerCase() === "emergency"
-            ? "emergency"
-            : data.triage.level.toLowerCase() === "urgent"
-            ? "urgent"
-            : "routine";
-
-        appendMessage(
-          `<div class="triage-badge ${badgeClass}">
-            <strong>${data.triage.level}</strong> — ${data.triage.reason}
-          </div>`,
-          "bot"
-        );
+        showTriage(data.triage);
+      } else {
+        fetch(`http://127.0.0.1:8000/api/triage/${sessionId}?wait=20`, {
+          headers: { Authorization: `Bearer ${token}` },
+        })
+          .then((r) => r.json())
+          .then((t) => t.triage && showTriage(t.triage))
+          .catch((err) => console.error("❌ Error fetching triage:", err));
       }
     } catch {
       setIsTyping(false);
@@ -112,12 +188,30 @@ export default function Chat() {
     }
   };
 
+  // ===== TRIAGE BADGE (KEEP ORIGINAL FUNCTIONALITY) =====
+  const showTriage = (triage) => {
+    let badgeClass =
+      triage.level.toLowerCase() === "emergency"
+        ? "emergency"
+        : triage.level.toLowerCase() === "urgent"
+        ? "urgent"
+        : "routine";
+
+    appendMessage(
+      `<div class="triage-badge ${badgeClass}">
+        <strong>${triage.level}</strong> — ${triage.reason}
+      </div>`,
+      "bot"
+    );
+  };
+
   // ===== SUMMARY GENERATOR =====
   const generateSummary = async () => {
     appendMessage("<div class='meta'>🧠 Generating case summary...</div>", "meta");
 
     try {
-      const res = await fetch("http://127.0.0.1:8000/api/generate_summary", {
+      // one generation for summary + diagnoses; the Diagnosis button then reuses it
+      const res = await fetch(`http://127.0.0.1:8000/api/generate_report?session_id=${sessionId}`, {
         method: "POST",
         headers: { Authorization: `Bearer ${token}` },
       });
@@ -127,7 +221,7 @@ export default function Chat() {
       appendMessage(
         `<div class='summary-box'>
           <h3>🧾 <strong>Case Summary:</strong></h3>
-          <div>${data.summary}</div>
+          <div>${data.summary || data.error}</div>
         </div>`,
         "bot"
       );
@@ -143,7 +237,7 @@ export default function Chat() {
     appendMessage("<div class='meta'>Analyzing conversation for possible diagnoses...</div>", "meta");
 
     try {
-      const res = await fetch("http://127.0.0.1:8000/api/generate_diagnosis", {
+      const res = await fetch(`http://127.0.0.1:8000/api/generate_diagnosis?session_id=${sessionId}`, {
         method: "POST",
         headers: { Authorization: `Bearer ${token}` },
       });
@@ -276,6 +370,12 @@ export default function Chat() {
               </div>
             ))
           )}
+
+          {historyCursor && (
+            <div className="sidebar-item hoverable" onClick={() => loadSummaries(historyCursor)}>
+              <p>Load older summaries</p>
+            </div>
+          )}
         </div>
       </div>
 
@@ -1,33 +1,142 @@
 # guideline_verifier.py
-import json, os
+import json, os, re, time
+from triage_engine import KeywordMatcher
 
 GUIDELINE_PATH = "data/guidelines.json"
+# Built offline with: python bm25_index.py <encyclopedia.pdf> data/guidelines_bm25.idx
+GUIDELINE_INDEX_PATH = os.getenv("GUIDELINE_INDEX_PATH", "data/guidelines_bm25.idx")
 
-def load_guidelines():
-    if not os.path.exists(GUIDELINE_PATH):
+GUIDELINE_RELOAD_CHECK = float(os.getenv("GUIDELINE_RELOAD_CHECK", 2.0))  # seconds between mtime checks
+LEVEL_PRIORITY = {"Emergency": 3, "Urgent": 2, "Routine": 1}
+
+def load_guidelines(path=GUIDELINE_PATH):
+    if not os.path.exists(path):
         return {}
-    with open(GUIDELINE_PATH, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-GUIDELINES = load_guidelines()
+def normalize(text):
+    """Lowercase, drop dots (U.T.I. -> uti), turn other punctuation into spaces."""
+    text = re.sub(r"\.", "", str(text).lower())
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+class GuidelineSnapshot:
+    """Immutable, precompiled view of one version of the guideline file."""
+
+    def __init__(self, guidelines, mtime=None):
+        self.guidelines = guidelines
+        self.mtime = mtime
+        self.names = {}  # normalized name or synonym -> guideline key
+        for key, doc in guidelines.items():
+            for name in [key] + list(doc.get("synonyms", [])):
+                self.names.setdefault(normalize(name), key)
+        self.matcher = KeywordMatcher(self.names)
+
+    def lookup(self, text):
+        """Guideline keys mentioned in `text` (exact name, synonym, or whole-word mention)."""
+        norm = normalize(text)
+        if norm in self.names:
+            return [self.names[norm]]
+        keys = []
+        for name in self.matcher.find([norm]):
+            if self.names[name] not in keys:
+                keys.append(self.names[name])
+        return keys
+
+
+class GuidelineStore:
+    """
+    Serves the current GuidelineSnapshot and swaps in a new one when the file's
+    mtime changes. Readers always see a complete snapshot; a broken file keeps the old one.
+    Nothing is read until the first current() call (see preload()).
+    """
+
+    def __init__(self, path=GUIDELINE_PATH, check_interval=GUIDELINE_RELOAD_CHECK):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._next_check = 0.0
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def current(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            mtime = self._mtime()
+            if self._snapshot is None or mtime != self._snapshot.mtime:
+                try:
+                    first = self._snapshot is None
+                    self._snapshot = GuidelineSnapshot(load_guidelines(self.path), mtime)
+                    if not first:
+                        print(f"🔄 Reloaded {len(self._snapshot.guidelines)} guidelines")
+                except Exception as e:
+                    print(f"❌ Guideline reload failed, keeping previous set: {e}")
+                    if self._snapshot is None:
+                        self._snapshot = GuidelineSnapshot({}, None)  # retried at the next check
+        return self._snapshot
+
+
+STORE = GuidelineStore()
 
 def verify(triage_result, top_diagnoses=[]):
     """
     triage_result: {"level":..., "reason":...}
-    top_diagnoses: list of strings
+    top_diagnoses: list of strings (diagnoses, or complaint / symptom text)
     Returns possibly adjusted triage_result
     """
-    # Very simple: if any diagnosis in top_diagnoses maps to a more severe level, upgrade
-    level_priority = {"Emergency": 3, "Urgent": 2, "Routine": 1}
+    return _verify(STORE.current(), triage_result, top_diagnoses)
+
+def verify_many(items):
+    """Bulk verify [(triage_result, top_diagnoses), ...] against one snapshot."""
+    snapshot = STORE.current()
+    return [_verify(snapshot, triage, diagnoses) for triage, diagnoses in items]
+
+def _verify(snapshot, triage_result, top_diagnoses):
+    # Upgrade to the most severe level recommended by any matching guideline
     level = triage_result["level"]
-    for d in top_diagnoses:
-        doc = GUIDELINES.get(d.lower())
-        if doc:
+    best = None
+    for d in top_diagnoses or []:
+        for key in snapshot.lookup(d):
+            doc = snapshot.guidelines[key]
             recommended = doc.get("recommended_triage", "Routine")
-            if level_priority.get(recommended, 1) > level_priority.get(level, 1):
-                return {"level": recommended, 
-                        "reason": f"Upgraded per guideline for {d}: {doc.get('note','')}"}
+            if LEVEL_PRIORITY.get(recommended, 1) > LEVEL_PRIORITY.get(best[0] if best else level, 1):
+                best = (recommended, d, doc)
+    if best:
+        recommended, d, doc = best
+        return {"level": recommended,
+                "reason": f"Upgraded per guideline for {d}: {doc.get('note','')}"}
     return triage_result
+
+_index = None
+
+def _get_index():
+    global _index
+    if _index is None and os.path.exists(GUIDELINE_INDEX_PATH):
+        from bm25_index import BM25Index
+        _index = BM25Index(GUIDELINE_INDEX_PATH)
+    return _index
+
+def retrieve(query, k=3):
+    """
+    Top-k encyclopedia passages for `query` from the memory-mapped BM25 index.
+    Returns [] when no index has been built.
+    """
+    index = _get_index()
+    if index is None or not query.strip():
+        return []
+    return index.search(query, k)
+
+def preload():
+    """Load the guideline snapshot and map the BM25 index now instead of on the first request."""
+    snapshot = STORE.current()
+    _get_index()
+    return len(snapshot.guidelines)
 # guideline_verifier.py
 # from langchain_community.document_loaders import PyPDFLoader
 # from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -0,0 +1,131 @@
+# history_manager.py
+import asyncio
+import llm_client
+from triage_engine import affirmed_red_flags
+from utils import MODEL_NAME, HISTORY_TOKEN_BUDGET, HISTORY_KEEP_TURNS, HISTORY_FOLD_BATCH
+
+DIGEST_INSTRUCTION = """
+You maintain a short clinical digest of an ongoing doctor-patient consultation.
+Rewrite the digest so it also covers the new turns below. Keep every symptom,
+onset/duration, severity, medication, allergy, relevant history and any warning
+sign the patient mentioned. Plain sentences, at most 120 words, no greetings.
+Digest so far:
+"""
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) — only used to stay under the budget."""
+    return len(text) // 4 + 1
+
+
+class HistoryManager:
+    """
+    Bounds what the doctor agent sees of a long consultation.
+    Under the token budget the history is passed through unchanged. Past it, the
+    prompt gets a rolling digest of older turns plus the last `keep_turns` verbatim.
+    The digest is rewritten in the background every `fold_batch` older turns, so a
+    reply never waits for it; turns not yet folded stay verbatim while they fit.
+    Red flags from older patient turns are matched with triage_engine's table
+    (negated mentions skipped) and always listed next to the digest, whatever the model wrote.
+
+    State lives on session.digest:
+        {"text", "upto", "flags", "flags_upto", "task"}  (upto = absolute turn counts)
+    """
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, keep_turns=HISTORY_KEEP_TURNS, fold_batch=HISTORY_FOLD_BATCH):
+        self.budget = budget
+        self.keep_turns = keep_turns
+        self.fold_batch = fold_batch
+        self._tasks = set()  # strong refs to running folds
+        self.folds = 0
+        self.fold_errors = 0
+
+    def _state(self, session):
+        if session.digest is None:
+            base = session.total - len(session.turns)
+            session.digest = {"text": "", "upto": base, "flags": [], "flags_upto": base, "task": None}
+        return session.digest
+
+    def _split(self, session):
+        """(absolute index of the first trimmed-away turn, index in session.turns where the verbatim tail starts)"""
+        base = session.total - len(session.turns)
+        return base, max(len(session.turns) - self.keep_turns, 0)
+
+    def _update_flags(self, session, state, base, recent_start):
+        """Scan older patient turns not seen yet for red-flag keywords."""
+        start = max(state["flags_upto"] - base, 0)
+        texts = [t.content for t in session.turns[start:recent_start] if t.role == "user"]
+        for flag in affirmed_red_flags(texts):
+            if flag not in state["flags"]:
+                state["flags"].append(flag)
+        state["flags_upto"] = max(state["flags_upto"], base + recent_start)
+
+    @staticmethod
+    def render(state):
+        parts = []
+        if state["text"]:
+            parts.append(f"Earlier in this consultation: {state['text']}")
+        if state["flags"]:
+            parts.append(f"Red flags mentioned earlier: {', '.join(state['flags'])}")
+        return "\n".join(parts) or None
+
+    def window(self, session):
+        """
+        (digest or None, messages) to build the doctor prompt from.
+        Messages are {"role", "content"} dicts like Session.history().
+        """
+        history = session.history()
+        if sum(estimate_tokens(m["content"]) for m in history) <= self.budget:
+            return None, history
+
+        state = self._state(session)
+        base, recent_start = self._split(session)
+        self._update_flags(session, state, base, recent_start)
+        digest = self.render(state)
+
+        # unfolded older turns, kept verbatim (newest first) while the budget allows
+        pending_start = min(max(state["upto"] - base, 0), recent_start)
+        recent = history[recent_start:]
+        used = estimate_tokens(digest or "") + sum(estimate_tokens(m["content"]) for m in recent)
+        kept = []
+        for m in reversed(history[pending_start:recent_start]):
+            used += estimate_tokens(m["content"])
+            if used > self.budget:
+                break
+            kept.append(m)
+        return digest, kept[::-1] + recent
+
+    def schedule(self, session):
+        """Start a background fold once enough older turns are waiting (call after each reply)."""
+        if sum(estimate_tokens(t.content) for t in session.turns) <= self.budget:
+            return
+        state = self._state(session)
+        if state["task"] is not None and not state["task"].done():
+            return
+        base, recent_start = self._split(session)
+        start = max(state["upto"] - base, 0)
+        if recent_start - start < self.fold_batch:
+            return
+        turns = [(t.role, t.content) for t in session.turns[start:recent_start]]
+        task = asyncio.create_task(self._fold(state, state["text"], turns, base + recent_start))
+        state["task"] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, state, previous, turns, upto):
+        lines = "\n".join(f"{'Patient' if role == 'user' else 'Doctor'}: {content}" for role, content in turns)
+        prompt = DIGEST_INSTRUCTION + (previous or "(empty)") + "\n\nNew turns:\n" + lines + "\n\nUpdated digest:"
+        try:
+            data = await llm_client.generate(prompt, model=MODEL_NAME, timeout=60,
+                                             priority="extraction", agent="digest")
+            text = (data.get("response") or "").strip()
+            if text and state["upto"] < upto:
+                state["text"], state["upto"] = text, upto
+                self.folds += 1
+        except Exception as e:
+            self.fold_errors += 1
+            print(f"❌ History digest update failed: {e}")
+
+    def stats(self):
+        return {"budget_tokens": self.budget, "keep_turns": self.keep_turns,
+                "folds": self.folds, "fold_errors": self.fold_errors, "running": len(self._tasks)}
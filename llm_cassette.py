@@ -0,0 +1,83 @@
+# llm_cassette.py
+import gzip, hashlib, json, os, re
+
+# Fields that differ on every run and are useless for replay
+_VOLATILE = ("created_at",)
+
+
+def request_key(payload):
+    """sha256 over model, prompt, stream flag and every other option (context, num_predict, ...) except keep_alive."""
+    options = {k: v for k, v in payload.items() if k not in ("model", "prompt", "stream", "keep_alive")}
+    blob = json.dumps([payload.get("model"), payload.get("stream", False),
+                       hashlib.sha256(payload.get("prompt", "").encode("utf-8")).hexdigest(), options],
+                      sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette:
+    """
+    Recorded /api/generate responses in one append-only JSONL file (gzip if it ends in .gz).
+    Each line is {"k": request key, "ms": recorded latency, "body": response} for plain calls,
+    or {"k", "ms", "text": full streamed text, "final": last chunk or null} for streams.
+    Later lines for the same key win.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with self._open("r") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # torn last line
+                        self._entries[entry["k"]] = entry
+        return self._entries
+
+    def get(self, key):
+        entry = self._load().get(key)
+        if entry is None:
+            self.misses += 1
+            raise CassetteMiss(f"No recorded LLM response for request {key[:12]}… in {self.path}")
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        entry = {"k": key, **entry}
+        if "body" in entry:
+            entry["body"] = {k: v for k, v in entry["body"].items() if k not in _VOLATILE}
+        self._load()[key] = entry
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # gzip appends add a new member; readers see one continuous stream
+        with self._open("a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.recorded += 1
+
+    def stats(self):
+        return {"path": self.path, "entries": len(self._load()), "hits": self.hits,
+                "misses": self.misses, "recorded": self.recorded}
+
+
+def replay_chunks(entry):
+    """Re-split a recorded stream into word-sized chunks, ending with the recorded final chunk."""
+    for piece in re.findall(r"\s*\S+", entry["text"]):
+        yield {"response": piece, "done": False}
+    if entry.get("final"):
+        yield dict(entry["final"], response="")
@@ -0,0 +1,226 @@
+# llm_client.py
+import asyncio
+import json
+import time
+import httpx
+import metrics
+from llm_cassette import Cassette, request_key, replay_chunks
+from llm_router import LLMRouter, parse_endpoints
+from llm_scheduler import LLMScheduler, parse_model_limits
+from utils import (OLLAMA_URL, MODEL_NAME, LLM_MAX_CONCURRENCY, LLM_MAX_KEEPALIVE,
+                   LLM_MODEL_LIMITS, LLM_QUEUE_MAX, LLM_BACKEND, LLM_CASSETTE, LLM_REPLAY_LATENCY_MS,
+                   GENERATION_PROFILES, OLLAMA_ENDPOINTS, LLM_HEALTH_INTERVAL, LLM_CIRCUIT_FAILURES,
+                   LLM_CIRCUIT_COOLDOWN, LLM_RETRIES, LLM_KEEP_ALIVE)
+
+ENDPOINTS = parse_endpoints(OLLAMA_ENDPOINTS, OLLAMA_URL)
+
+
+def _endpoint_limits(limits, endpoints):
+    """Per-endpoint model caps -> fleet-wide caps (times the number of endpoints serving each model)."""
+    return {model: n * sum(1 for _, models in endpoints if models is None or model in models)
+            for model, n in limits.items()}
+
+
+# Every request waits for a slot here, by priority (see llm_scheduler.PRIORITIES).
+# LLM_MAX_CONCURRENCY and LLM_MODEL_LIMITS are per endpoint, so each added server adds capacity.
+SCHEDULER = LLMScheduler(LLM_MAX_CONCURRENCY * len(ENDPOINTS),
+                         _endpoint_limits(parse_model_limits(LLM_MODEL_LIMITS), ENDPOINTS), LLM_QUEUE_MAX)
+
+# Which Ollama server handles each request (least in-flight, circuit breaking, retries)
+ROUTER = LLMRouter(ENDPOINTS, failure_threshold=LLM_CIRCUIT_FAILURES,
+                   cooldown=LLM_CIRCUIT_COOLDOWN, retries=LLM_RETRIES)
+
+# record: call Ollama and save every response; replay: answer from the cassette only
+CASSETTE = Cassette(LLM_CASSETTE) if LLM_BACKEND in ("record", "replay") else None
+
+# One pooled client per event loop, shared by all endpoints (requests use absolute URLs).
+# (FastAPI runs a single loop; scripts that call asyncio.run() get a fresh one.)
+_client = None
+_loop = None
+CONNECT_TIMEOUT = 5.0
+
+
+def _timeout(seconds):
+    """Per-call read/write budget; connecting stays short so a dead host fails over fast."""
+    return httpx.Timeout(seconds, connect=CONNECT_TIMEOUT)
+
+
+def _get_client():
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY * len(ROUTER.endpoints),
+                max_keepalive_connections=LLM_MAX_KEEPALIVE * len(ROUTER.endpoints),
+            ),
+            timeout=_timeout(60.0),
+        )
+        _loop = loop
+    return _client
+
+
+def _apply_profile(payload, agent):
+    """Merge the agent's generation profile into the payload; explicit options win."""
+    # without keep_alive every call would reset the model's pin to Ollama's 5 minute default
+    payload.setdefault("keep_alive", LLM_KEEP_ALIVE)
+    profile = GENERATION_PROFILES.get(agent)
+    if not profile:
+        return payload
+    for key, value in profile.items():
+        if key == "options":
+            payload["options"] = {**value, **payload.get("options", {})}
+        else:
+            payload.setdefault(key, value)
+    return payload
+
+
+async def _replay_delay(entry):
+    ms = entry.get("ms", 0) if LLM_REPLAY_LATENCY_MS == "recorded" else float(LLM_REPLAY_LATENCY_MS)
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+
+async def generate(prompt, model=None, timeout=60, priority="chat", agent=None, **extra):
+    """
+    POST a non-streaming request to Ollama's /api/generate and return the JSON body.
+    Waits for a scheduler slot of the given priority first; `timeout` starts after that.
+    `agent` selects the generation profile (utils.GENERATION_PROFILES) and labels the metrics.
+    Extra keyword arguments (e.g. context, options) are merged into the payload as-is.
+    Raises httpx errors (or CassetteMiss in replay mode) so each agent can keep its own fallback messages.
+    """
+    payload = {"model": model or MODEL_NAME, "prompt": prompt, "stream": False}
+    payload.update(extra)
+    _apply_profile(payload, agent)
+    if LLM_BACKEND == "replay":
+        entry = CASSETTE.get(request_key(payload))
+        await _replay_delay(entry)
+        return entry["body"]
+
+    client = _get_client()
+
+    async def send(endpoint):
+        r = await client.post(endpoint.url + "/api/generate", json=payload, timeout=_timeout(timeout))
+        r.raise_for_status()
+        return r.json()
+
+    async with SCHEDULER.slot(payload["model"], priority):
+        started = time.monotonic()
+        data = await ROUTER.call(payload["model"], send)
+    elapsed = time.monotonic() - started
+    metrics.observe_ollama(agent, payload["model"], data, elapsed)
+    if CASSETTE is not None:
+        CASSETTE.put(request_key(payload), {"ms": round(elapsed * 1000), "body": data})
+    return data
+
+
+async def stream_generate(prompt, model=None, timeout=60, priority="chat", agent=None, **extra):
+    """
+    Stream /api/generate, yielding each NDJSON chunk as a dict.
+    Closing the generator early (e.g. with contextlib.aclosing) drops the
+    connection, which makes Ollama stop generating.
+    In record mode, whatever was received before closing is what gets saved.
+    """
+    payload = {"model": model or MODEL_NAME, "prompt": prompt, "stream": True}
+    payload.update(extra)
+    _apply_profile(payload, agent)
+    if LLM_BACKEND == "replay":
+        entry = CASSETTE.get(request_key(payload))
+        await _replay_delay(entry)
+        for chunk in replay_chunks(entry):
+            yield chunk
+        return
+
+    client = _get_client()
+
+    async def open_stream(endpoint):
+        # only connecting + the status line are retried on another node, never a half-sent reply
+        request = client.build_request("POST", endpoint.url + "/api/generate", json=payload, timeout=_timeout(timeout))
+        r = await client.send(request, stream=True)
+        if r.is_error:
+            await r.aclose()
+        r.raise_for_status()
+        endpoint.inflight += 1  # held until the stream is closed
+        return r, endpoint
+
+    text, final, failed, started = [], None, False, time.monotonic()
+    try:
+        async with SCHEDULER.slot(payload["model"], priority):
+            started = time.monotonic()
+            r, endpoint = await ROUTER.call(payload["model"], open_stream)
+            try:
+                async for line in r.aiter_lines():
+                    if line.strip():
+                        chunk = json.loads(line)
+                        text.append(chunk.get("response", ""))
+                        if chunk.get("done"):
+                            final = chunk
+                        yield chunk
+            except httpx.TransportError:
+                ROUTER.failure(endpoint)
+                raise
+            finally:
+                endpoint.inflight -= 1
+                await r.aclose()
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        if not failed:
+            metrics.observe_ollama(agent, payload["model"], final, elapsed)
+        if CASSETTE is not None and not failed and (text or final):
+            CASSETTE.put(request_key(payload), {"ms": round(elapsed * 1000),
+                                                "text": "".join(text), "final": final})
+
+
+def check_capacity(priority="chat"):
+    """Raise QueueFull when new work of this priority should be turned away (HTTP 429)."""
+    SCHEDULER.check(priority)
+
+
+async def preload_models(models, timeout=600):
+    """
+    Load (and pin with keep_alive) each model on every endpoint that serves it.
+    Returns {model: number of endpoints where it is loaded}.
+    """
+    client = _get_client()
+
+    async def load(endpoint, model):
+        try:
+            r = await client.post(endpoint.url + "/api/generate",
+                                  json={"model": model, "keep_alive": LLM_KEEP_ALIVE}, timeout=_timeout(timeout))
+            r.raise_for_status()
+            return model, True
+        except Exception as e:
+            print(f"❌ Could not preload {model} on {endpoint.url}: {e}")
+            return model, False
+
+    jobs = [load(e, m) for m in models for e in ROUTER.endpoints if e.serves(m)]
+    loaded = {m: 0 for m in models}
+    for model, ok in await asyncio.gather(*jobs):
+        loaded[model] += ok
+    return loaded
+
+
+def start_health_checks():
+    """Probe every endpoint in the background (call from app startup)."""
+    ROUTER.start_probes(_get_client, LLM_HEALTH_INTERVAL)
+
+
+def stats():
+    data = SCHEDULER.stats()
+    data["backend"] = LLM_BACKEND
+    data["endpoints"] = ROUTER.stats()
+    if CASSETTE is not None:
+        data["cassette"] = CASSETTE.stats()
+    return data
+
+
+async def aclose():
+    """Stop health probes and close the pooled connections (called on app shutdown)."""
+    global _client
+    await ROUTER.stop_probes()
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
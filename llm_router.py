@@ -0,0 +1,182 @@
+# llm_router.py
+import asyncio, random, time
+import httpx
+
+
+def parse_endpoints(spec, default_url):
+    """
+    'http://a:11434=mistral:latest|llama3,http://b:11434' -> [(url, {models} or None), ...]
+    An endpoint without '=' serves every model. An empty spec means just `default_url`.
+    """
+    endpoints = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        url, _, models = part.partition("=")
+        endpoints.append((url.rstrip("/"), set(filter(None, models.split("|"))) or None))
+    return endpoints or [(default_url.rstrip("/"), None)]
+
+
+class NoEndpoint(httpx.ConnectError):
+    """No healthy endpoint serves the requested model. A ConnectError so agents report 'offline'."""
+
+
+class Endpoint:
+    __slots__ = ("url", "models", "inflight", "failures", "open_until", "requests", "errors")
+
+    def __init__(self, url, models=None):
+        self.url = url
+        self.models = models
+        self.inflight = 0
+        self.failures = 0       # consecutive
+        self.open_until = 0.0   # circuit open (skipped) until this monotonic time
+        self.requests = 0
+        self.errors = 0
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+
+class LLMRouter:
+    """
+    Spreads requests over several Ollama servers: least in-flight first, nodes
+    with an open circuit are skipped, and failed attempts move to another node
+    after a short, capped backoff.
+    A node's circuit opens after `failure_threshold` consecutive failures. After
+    `cooldown` seconds it half-opens: one trial request at a time until one succeeds
+    (closing it) or fails (reopening it). A good health probe closes it as well.
+    """
+
+    def __init__(self, endpoints, failure_threshold=3, cooldown=15.0, retries=2,
+                 backoff=0.2, backoff_max=2.0):
+        self.endpoints = [Endpoint(url, models) for url, models in endpoints]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._probe_task = None
+
+    def available(self, endpoint, now):
+        if endpoint.open_until > now:
+            return False  # open
+        # half-open: a single trial request in flight
+        return endpoint.failures < self.failure_threshold or endpoint.inflight == 0
+
+    def pick(self, model, exclude=()):
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints
+                      if e.serves(model) and self.available(e, now) and e not in exclude]
+        if not candidates:
+            raise NoEndpoint(f"No available Ollama endpoint serves {model}")
+        least = min(e.inflight for e in candidates)
+        return random.choice([e for e in candidates if e.inflight == least])
+
+    def has_alternative(self, model, exclude):
+        now = time.monotonic()
+        return any(e.serves(model) and self.available(e, now) and e not in exclude for e in self.endpoints)
+
+    def success(self, endpoint):
+        endpoint.failures = 0
+        endpoint.open_until = 0.0
+
+    def failure(self, endpoint):
+        endpoint.errors += 1
+        endpoint.failures += 1
+        if endpoint.failures >= self.failure_threshold:
+            if endpoint.open_until <= time.monotonic():
+                print(f"⚠️ Circuit open for {endpoint.url} after {endpoint.failures} failures")
+            endpoint.open_until = time.monotonic() + self.cooldown
+
+    @staticmethod
+    def retryable(exc):
+        """Node-level problems worth trying elsewhere (not bad requests)."""
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500 or exc.response.status_code == 404
+        return isinstance(exc, (httpx.TransportError,))
+
+    async def backoff_sleep(self, attempt):
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def call(self, model, send):
+        """
+        Run `await send(endpoint)` on the best node, retrying on other nodes.
+        Each node is tried at most once per request, so one failing request counts
+        at most one failure against a node's breaker. Read timeouts are not retried
+        (the node was busy generating, a retry would double the wait).
+        Raises the last error when no other node is left to try.
+        """
+        tried, last_error = [], None
+        for attempt in range(self.retries + 1):
+            try:
+                endpoint = self.pick(model, tried)
+            except NoEndpoint:
+                if not tried:
+                    raise
+                raise last_error
+            tried.append(endpoint)
+            endpoint.inflight += 1
+            endpoint.requests += 1
+            try:
+                result = await send(endpoint)
+                self.success(endpoint)
+                return result
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                # a 404 means the model isn't pulled there — the node itself is fine
+                if not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404):
+                    self.failure(endpoint)
+                if attempt == self.retries or isinstance(e, httpx.ReadTimeout) or not self.has_alternative(model, tried):
+                    raise
+                last_error = e
+                print(f"🔄 {endpoint.url} failed ({type(e).__name__}), retrying on another node")
+                await self.backoff_sleep(attempt)
+            finally:
+                endpoint.inflight -= 1
+
+    # -----------------------------
+    # Health probes
+    # -----------------------------
+    async def probe(self, client):
+        for endpoint in self.endpoints:
+            try:
+                r = await client.get(endpoint.url + "/api/tags", timeout=3.0)
+                r.raise_for_status()
+                self.success(endpoint)
+            except Exception:
+                self.failure(endpoint)
+
+    def start_probes(self, client_factory, interval=10.0):
+        if self._probe_task and not self._probe_task.done():
+            return
+
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.probe(client_factory())
+                except Exception as e:
+                    print(f"❌ Health probe error: {e}")
+
+        self._probe_task = asyncio.create_task(loop())
+
+    async def stop_probes(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def stats(self):
+        now = time.monotonic()
+        return [{
+            "url": e.url,
+            "models": sorted(e.models) if e.models else "*",
+            "inflight": e.inflight,
+            "requests": e.requests,
+            "errors": e.errors,
+            "circuit": ("open" if e.open_until > now
+                        else "half-open" if e.failures >= self.failure_threshold else "closed"),
+        } for e in self.endpoints]
@@ -0,0 +1,137 @@
+# llm_scheduler.py
+import asyncio, heapq, itertools, math, time
+
+# Lower number runs first
+PRIORITIES = {"emergency": 0, "chat": 1, "extraction": 2, "report": 3}
+
+
+def parse_model_limits(spec):
+    """'mistral:latest=2,llama3=4' -> {"mistral:latest": 2, "llama3": 4}"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        model, _, n = part.rpartition("=")
+        limits[model.strip()] = int(n)
+    return limits
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"LLM queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """
+    Central gate in front of the model server.
+    Each request waits for a slot under both the global cap and its model's cap;
+    freed slots go to the highest-priority waiter (FIFO within a priority).
+    Emergency work is never rejected; everything else is once `queue_max` requests wait.
+    """
+
+    def __init__(self, max_concurrency=8, model_limits=None, queue_max=64):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.queue_max = queue_max
+        self._queue = []  # heap of (priority, seq, model, future)
+        self._seq = itertools.count()
+        self._running = {}  # model -> in-flight count
+        self._total = 0
+        self._service_time = 5.0  # EWMA of seconds per request, for Retry-After
+        self._stats = {p: {"queued": 0, "started": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+                       for p in PRIORITIES}
+
+    def _limit(self, model):
+        return min(self.model_limits.get(model, self.max_concurrency), self.max_concurrency)
+
+    def _start(self, model):
+        self._running[model] = self._running.get(model, 0) + 1
+        self._total += 1
+
+    def depth(self):
+        return sum(s["queued"] for s in self._stats.values())
+
+    def retry_after(self):
+        """Rough seconds until the current queue drains."""
+        return max(1, math.ceil(self._service_time * (self.depth() + 1) / self.max_concurrency))
+
+    def check(self, priority):
+        """Raise QueueFull if a new `priority` request should be turned away right now."""
+        if priority != "emergency" and self.depth() >= self.queue_max:
+            self._stats[priority]["rejected"] += 1
+            raise QueueFull(self.retry_after())
+
+    async def acquire(self, model, priority="chat"):
+        stats = self._stats[priority]
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), model, future))
+        stats["queued"] += 1
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(model)  # slot was handed over just as we were cancelled
+            raise
+        finally:
+            stats["queued"] -= 1
+        waited = time.monotonic() - queued_at
+        stats["started"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def release(self, model, elapsed=None):
+        self._running[model] -= 1
+        self._total -= 1
+        if elapsed is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters in priority order, skipping models at their cap."""
+        blocked = []
+        while self._queue and self._total < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            _, _, model, future = entry
+            if future.done():
+                continue  # waiter was cancelled
+            if self._running.get(model, 0) >= self._limit(model):
+                blocked.append(entry)
+                continue
+            self._start(model)
+            future.set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+    def slot(self, model, priority="chat"):
+        return _Slot(self, model, priority)
+
+    def stats(self):
+        return {
+            "running": self._total,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.depth(),
+            "queue_max": self.queue_max,
+            "retry_after_seconds": self.retry_after(),
+            "models": {m: {"running": n, "limit": self._limit(m)} for m, n in self._running.items()},
+            "priorities": {
+                p: {"queued": s["queued"], "started": s["started"], "rejected": s["rejected"],
+                    "wait_avg_ms": round(1000 * s["wait_total"] / s["started"], 1) if s["started"] else 0.0,
+                    "wait_max_ms": round(1000 * s["wait_max"], 1)}
+                for p, s in self._stats.items()
+            },
+        }
+
+
+class _Slot:
+    """async with scheduler.slot(model, priority): ... — holds one slot for the block."""
+
+    def __init__(self, scheduler, model, priority):
+        self.scheduler, self.model, self.priority = scheduler, model, priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.model, self.priority)
+        self.started = time.monotonic()
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(self.model, time.monotonic() - self.started)
@@ -1,23 +1,34 @@
-import os, json, time, random, requests
+import os, json, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
-from jose import jwt, JWTError
 from pydantic import BaseModel
-import motor.motor_asyncio
 from dotenv import load_dotenv
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import AI + utility modules
-from doctor_agent import doctor_reply
-from symptom_extractor import extract_structured
-from triage_engine import evaluate_triage
-from guideline_verifier import verify
-from utils import log_session
+from doctor_agent import doctor_reply, doctor_reply_stream
+from symptom_extractor import extract_structured, extract_incremental
+from triage_engine import evaluate_triage, evaluate_triage_batch, scan_message, escalation_text
+from guideline_verifier import verify, verify_many, retrieve
+import guideline_verifier
+from summary_agent import generate_summary, ERROR_PREFIXES as SUMMARY_ERRORS
+from differential_diagnosis import generate_differential_diagnosis, ERROR_PREFIXES as DIAGNOSIS_ERRORS
+from case_report import generate_case_report, format_differential
+from utils import INCREMENTAL_EXTRACTION, MODEL_NAME, REPORT_MODEL_NAME, REPORT_CACHE_SIZE, LLM_BACKEND
+from session_store import SessionStore
+from history_manager import HistoryManager
+from session_log import SessionLogWriter
+from auth_cache import PrincipalCache
+from result_cache import ResultCache, content_key
+import llm_client
+import metrics
+from metrics import STAGE_SECONDS, MONGO_SECONDS
+from llm_scheduler import QueueFull
 
 # ----------------------------------------
 # FastAPI Setup
@@ -35,19 +46,111 @@ app.add_middleware(
 load_dotenv()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-SESSIONS = {}
-message_logs = []
+@app.on_event("startup")
+async def compress_old_logs():
+    await asyncio.to_thread(SESSION_LOG.compress_old)
+
+@app.on_event("startup")
+async def start_llm_health_checks():
+    llm_client.start_health_checks()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+    await SESSION_LOG.close()
+    _hash_pool.shutdown(wait=False)
+
+SESSIONS = SessionStore()
+HISTORY = HistoryManager()
+SESSION_LOG = SessionLogWriter()
 
 # ----------------------------------------
 # MongoDB Setup
 # ----------------------------------------
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-db = client["carecompanion"]
-users = db["users"]
-summaries = db["summaries"]
-diagnoses = db["diagnoses"]
-health_plans = db["health_plans"]  # ✅ NEW COLLECTION
+client = db = users = summaries = diagnoses = health_plans = None
+
+@app.on_event("startup")
+def connect_mongo():
+    """Create the Motor client at startup rather than import (it does no I/O until the first query)."""
+    global client, db, users, summaries, diagnoses, health_plans
+    if client is not None:
+        return
+    import motor.motor_asyncio
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    db = client["carecompanion"]
+    users = db["users"]
+    summaries = db["summaries"]
+    diagnoses = db["diagnoses"]
+    health_plans = db["health_plans"]  # ✅ NEW COLLECTION
+
+async def ensure_indexes():
+    """
+    Create the indexes the auth + history queries rely on (no-op if they exist).
+    Each one is independent: e.g. duplicate emails blocking the unique index must
+    not leave the history collections unindexed.
+    """
+    indexes = [
+        (users, "email", {"unique": True}),
+        (summaries, [("user_email", 1), ("timestamp", -1), ("_id", -1)], {}),
+        (diagnoses, [("user_email", 1), ("timestamp", -1), ("_id", -1)], {}),
+        # combined case reports, looked up by conversation (see _stored_report)
+        (summaries, [("user_email", 1), ("conversation_key", 1)],
+         {"partialFilterExpression": {"conversation_key": {"$exists": True}}}),
+    ]
+    for coll, keys, options in indexes:
+        try:
+            await coll.create_index(keys, **options)
+        except Exception as e:
+            print(f"❌ Could not ensure MongoDB index {coll.name}.{keys}: {e}")
+
+# ----------------------------------------
+# Warmup & Readiness
+# ----------------------------------------
+# The server accepts connections right away; /ready stays 503 until these pass.
+READINESS = {"imports": False, "data": False, "models": False}
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 5))
+
+def _warm_imports():
+    from jose import jwt  # noqa: F401
+    try:
+        _get_pwd_context().hash("warmup")  # also loads the bcrypt backend
+    except Exception as e:
+        print(f"❌ Password hashing warmup failed: {e}")
+
+async def _preload_models():
+    """Pin every configured model on at least one endpoint, retrying while Ollama is still starting."""
+    models = sorted({MODEL_NAME, REPORT_MODEL_NAME})
+    while LLM_BACKEND != "replay":  # replayed runs never touch a model server
+        loaded = await llm_client.preload_models(models)
+        if all(loaded.values()):
+            print(f"✅ Models loaded: {loaded}")
+            break
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+    READINESS["models"] = True
+
+async def _warmup():
+    try:
+        await asyncio.to_thread(_warm_imports)
+        READINESS["imports"] = True
+        count = await asyncio.to_thread(guideline_verifier.preload)
+        READINESS["data"] = True
+        print(f"✅ {count} guidelines loaded")
+        await asyncio.gather(ensure_indexes(), _preload_models())
+    except Exception as e:
+        print(f"❌ Warmup failed: {e}")
+
+@app.on_event("startup")
+async def start_warmup():
+    task = asyncio.create_task(_warmup())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.get("/ready")
+async def ready():
+    """200 once imports, data and models are warm; 503 before (for the load balancer)."""
+    body = {"ready": all(READINESS.values()), "checks": READINESS}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
 
 # ----------------------------------------
 # JWT & Password Hashing
@@ -55,27 +158,56 @@ health_plans = db["health_plans"]  # ✅ NEW COLLECTION
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_pwd_context = None
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def hash_password(password: str): return pwd_context.hash(password)
-def verify_password(password, hashed): return pwd_context.verify(password, hashed)
+# bcrypt is deliberately slow — run it on a small dedicated pool, never on the event loop
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", 2))
+_hash_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+# validated principals per token, so protected routes skip JWT decode + Mongo lookup
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+PRINCIPALS = PrincipalCache(ttl=AUTH_CACHE_TTL, max_entries=int(os.getenv("AUTH_CACHE_SIZE", 10000)))
+
+def _get_pwd_context():
+    """passlib is imported on first use (or by the startup warmup), not at module load."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+def hash_password(password: str): return _get_pwd_context().hash(password)
+def verify_password(password, hashed): return _get_pwd_context().verify(password, hashed)
+
+async def hash_password_async(password: str):
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+async def verify_password_async(password, hashed):
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, verify_password, password, hashed)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    cached = PRINCIPALS.get(token)
+    if cached:
+        return cached
+    from jose import jwt, JWTError
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if not email:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await users.find_one({"email": email})
+        with MONGO_SECONDS.time(op="find_user"):
+            user = await users.find_one({"email": email}, {"password": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
+        PRINCIPALS.put(token, user, payload.get("exp"))
         return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -91,21 +223,29 @@ class ChatRequest(BaseModel):
     session_id: str
     message: str
 
+class TriageBatchRequest(BaseModel):
+    records: list[dict]
+
 # ----------------------------------------
 # Auth Routes
 # ----------------------------------------
 @app.post("/register")
 async def register(user: User):
-    if await users.find_one({"email": user.email}):
+    with MONGO_SECONDS.time(op="find_user"):
+        existing = await users.find_one({"email": user.email})
+    if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_pw = hash_password(user.password)
-    await users.insert_one({"email": user.email, "password": hashed_pw})
+    hashed_pw = await hash_password_async(user.password)
+    with MONGO_SECONDS.time(op="insert_user"):
+        await users.insert_one({"email": user.email, "password": hashed_pw})
+    PRINCIPALS.invalidate_user(user.email)
     return {"message": "User registered successfully"}
 
 @app.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await users.find_one({"email": form_data.username})
-    if not user or not verify_password(form_data.password, user["password"]):
+    with MONGO_SECONDS.time(op="find_user"):
+        user = await users.find_one({"email": form_data.username})
+    if not user or not await verify_password_async(form_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": user["email"]})
     return {"access_token": token, "token_type": "bearer"}
@@ -124,115 +264,694 @@ def serve_chat():
 # ----------------------------------------
 # Chat Route
 # ----------------------------------------
-@app.post("/api/chat")
-async def chat(req: ChatRequest, current_user: dict = Depends(get_current_user)):
-    global message_logs
-    sid = req.session_id
+TRIAGE_DISPLAY = {
+    "Emergency": {"color": "#e63946", "status": "🔴 Emergency — Immediate care required!"},
+    "Urgent": {"color": "#ff8800", "status": "🟠 Urgent — Needs prompt medical attention."},
+    "Routine": {"color": "#2a9d8f", "status": "🟢 Routine — Non-urgent."},
+    "Normal": {"color": "#2a9d8f", "status": "🟢 Normal — Stable condition."}
+}
+
+EVIDENCE_CHARS = 400
+_background_tasks = set()  # strong refs so superseded jobs aren't garbage-collected mid-run
 
-    if sid not in SESSIONS:
-        SESSIONS[sid] = []
-        message_logs.clear()
+def _chat_priority(session, alert=None):
+    """Scheduler class for the doctor reply: red-flag messages and patients last triaged as Emergency go first."""
+    if alert:
+        return "emergency"
+    state = session.triage
+    if state and state["result"] and state["result"]["triage"]["level"] == "Emergency":
+        return "emergency"
+    return "chat"
 
-    # Store patient message
-    user_message = {"role": "patient", "message": req.message}
-    SESSIONS[sid].append({"role": "user", "content": req.message})
-    message_logs.append(user_message)
+def _fast_triage(message):
+    """
+    Red-flag and vitals rules on the raw message — microseconds, no LLM involved.
+    An Emergency here is returned before the doctor reply or extraction start.
+    """
+    with STAGE_SECONDS.time(stage="fast_triage"):
+        alert = scan_message(message)
+    return dict(_triage_info(alert), flags=alert["flags"]) if alert else None
 
+def _admit(priority):
+    """429 + Retry-After when the LLM queue is past its threshold."""
     try:
-        result = await run_in_threadpool(doctor_reply, SESSIONS[sid])
-        reply, severity_flag = result if isinstance(result, tuple) else (result, False)
-    except Exception as e:
-        print(f"❌ Doctor agent error: {e}")
-        raise HTTPException(status_code=500, detail=f"Doctor agent error: {e}")
+        llm_client.check_capacity(priority)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail="Model server is busy, please retry shortly.",
+                            headers={"Retry-After": str(e.retry_after)})
 
-    SESSIONS[sid].append({"role": "assistant", "content": reply})
-    message_logs.append({"role": "doctor", "message": reply})
+def _open_session(sid, current_user):
+    try:
+        return SESSIONS.open(sid, current_user["email"])
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Session belongs to another user")
 
-    conv_text = "\n".join([f"{m['role']}: {m.get('content', '')}" for m in SESSIONS[sid]])
-    structured = await run_in_threadpool(extract_structured, conv_text)
-    raw_triage = await run_in_threadpool(evaluate_triage, structured)
-    verified = verify(raw_triage, [])
+def _find_session(session_id, current_user):
+    """The caller's session by id, or their most recent one when no id is given."""
+    email = current_user["email"]
+    return SESSIONS.get(session_id, email) if session_id else SESSIONS.latest(email)
 
-    triage_display = {
-        "Emergency": {"color": "#e63946", "status": "🔴 Emergency — Immediate care required!"},
-        "Urgent": {"color": "#ff8800", "status": "🟠 Urgent — Needs prompt medical attention."},
-        "Routine": {"color": "#2a9d8f", "status": "🟢 Routine — Non-urgent."},
-        "Normal": {"color": "#2a9d8f", "status": "🟢 Normal — Stable condition."}
-    }
+def _append_turn(session, role, content):
+    SESSIONS.append(session, role, content)
+    SESSION_LOG.write(session.id, "turn", n=session.total, role=role, content=content)
 
+def _store_reply(session, reply, severity_flag, state):
+    _append_turn(session, "assistant", reply)
+    state["severity_flag"] = severity_flag
+    HISTORY.schedule(session)
+
+def _conv_text(turns):
+    return "\n".join([f"{t.role}: {t.content}" for t in turns])
+
+async def _extract(session, turns, upto):
+    """Structured extraction for the session, incremental when enabled."""
+    if not INCREMENTAL_EXTRACTION:
+        # long consultations: the rolling digest stands in for the older turns
+        digest = HistoryManager.render(session.digest) if session.digest else None
+        if digest:
+            turns = turns[-HISTORY.keep_turns:]
+        return await extract_structured((digest + "\n" if digest else "") + _conv_text(turns))
+
+    prev = session.extraction or {"record": None, "upto": 0}
+    new_turns = turns[max(len(turns) - (upto - prev["upto"]), 0):]
+    structured, ok = await extract_incremental(prev["record"], _conv_text(new_turns))
+
+    # on failure `upto` stays put, so the next turn re-sends these turns; a fallback
+    # skeleton is never stored as the base record.
+    # a slower job for an earlier turn must not overwrite a newer record
+    if ok and (not session.extraction or session.extraction["upto"] < upto):
+        session.extraction = {"record": structured, "upto": upto}
+    return structured
+
+def _guideline_terms(structured):
+    """Complaint + symptoms — matched against guideline names and synonyms."""
+    return [str(x) for x in [structured.get("chief_complaint")] + list(structured.get("associated_symptoms") or []) if x]
+
+def _triage_info(verified):
     level = verified.get("level", "Routine")
-    triage_info = {
+    return {
         "level": level,
         "reason": verified.get("reason", "No red flags found."),
-        "color": triage_display.get(level, {}).get("color", "#2a9d8f"),
-        "status": triage_display.get(level, {}).get("status", "🟢 Routine condition"),
-        "severity_flag": severity_flag
+        "color": TRIAGE_DISPLAY.get(level, {}).get("color", "#2a9d8f"),
+        "status": TRIAGE_DISPLAY.get(level, {}).get("status", "🟢 Routine condition"),
+    }
+
+async def _run_triage(session, state, turns, upto):
+    """Extraction + triage + guideline check for one turn; stores the result on `state`."""
+    try:
+        with STAGE_SECONDS.time(stage="extraction"):
+            structured = await _extract(session, turns, upto)
+        with STAGE_SECONDS.time(stage="triage"):
+            raw_triage = evaluate_triage(structured)
+        terms = _guideline_terms(structured)
+        with STAGE_SECONDS.time(stage="verify"):
+            verified = verify(raw_triage, terms)
+
+        triage_info = _triage_info(verified)
+        # a red flag in the patient's own words is never downgraded by the extraction
+        if state["alert"] and triage_info["level"] != "Emergency":
+            triage_info = state["alert"]
+        # ground the turn in encyclopedia passages when the BM25 index is available
+        query = " ".join(terms)
+        with STAGE_SECONDS.time(stage="evidence"):
+            evidence = [{"score": p["score"], "text": p["text"][:EVIDENCE_CHARS]} for p in retrieve(query, k=3)]
+        state["result"] = {"triage": triage_info, "structured": structured, "evidence": evidence}
+
+        SESSION_LOG.write(session.id, "triage", turn=upto, structured=structured, triage=triage_info)
+    except Exception as e:
+        print(f"❌ Triage pipeline error: {e}")
+        state["error"] = str(e)
+
+def _schedule_triage(session, alert=None):
+    """
+    Start extraction + triage for the latest patient turn in the background.
+    It only needs the patient's words, so it runs concurrently with the doctor reply.
+    `alert` is the fast-path Emergency for this turn, if any.
+    """
+    state = {"turn": session.total, "severity_flag": False, "result": None, "error": None,
+             "alert": alert, "reply": None, "reply_task": None}
+    if alert:
+        SESSION_LOG.write(session.id, "escalation", turn=session.total, triage=alert)
+    task = asyncio.create_task(_run_triage(session, state, list(session.turns), session.total))
+    state["task"] = task
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    session.triage = state
+    return state
+
+def _triage_view(state):
+    if state["result"] is None:
+        view = {"status": "error" if state["error"] else "pending", "turn": state["turn"]}
+        if state["alert"]:
+            view["triage"] = dict(state["alert"], severity_flag=state["severity_flag"], provisional=True)
+        return view
+    return {
+        "status": "ready",
+        "turn": state["turn"],
+        "triage": dict(state["result"]["triage"], severity_flag=state["severity_flag"]),
+        "structured": state["result"]["structured"],
+        "evidence": state["result"]["evidence"],
     }
 
-    log_session(sid, {"session": SESSIONS[sid], "structured": structured, "triage": triage_info, "ts": time.time()})
-    return {"reply": reply, "triage": triage_info, "structured": structured}
+@app.post("/api/chat")
+async def chat(req: ChatRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Returns the doctor reply as soon as it is ready. Triage is included only if the
+    background job already finished; otherwise poll GET /api/triage/{session_id}.
+    """
+    session = _open_session(req.session_id, current_user)
+    alert = _fast_triage(req.message)
+    priority = _chat_priority(session, alert)
+    _admit(priority)
+    _append_turn(session, "user", req.message)
+    state = _schedule_triage(session, alert)
+
+    if alert:
+        # escalate now; the doctor reply follows via GET /api/reply/{session_id}
+        _schedule_reply(session, state, priority)
+        view = _triage_view(state)
+        return {
+            "reply": escalation_text(alert),
+            "escalation": True,
+            "reply_status": "pending",
+            "triage": view.get("triage"),
+            "structured": view.get("structured"),
+            "triage_status": view["status"],
+            "turn": state["turn"],
+        }
+
+    try:
+        reply, severity_flag = await _doctor_turn(session, priority)
+    except Exception as e:
+        print(f"❌ Doctor agent error: {e}")
+        raise HTTPException(status_code=500, detail=f"Doctor agent error: {e}")
+
+    _store_reply(session, reply, severity_flag, state)
+    view = _triage_view(state)
+    return {
+        "reply": reply,
+        "triage": view.get("triage"),
+        "structured": view.get("structured"),
+        "triage_status": view["status"],
+        "turn": state["turn"],
+    }
+
+async def _doctor_turn(session, priority):
+    digest, messages = HISTORY.window(session)
+    with STAGE_SECONDS.time(stage="doctor_reply"):
+        result = await doctor_reply(messages, cache=session.prompt_cache, priority=priority, digest=digest)
+    return result if isinstance(result, tuple) else (result, False)
+
+async def _run_reply(session, state, priority):
+    try:
+        reply, severity_flag = await _doctor_turn(session, priority)
+    except Exception as e:
+        print(f"❌ Doctor agent error: {e}")
+        state["reply"] = {"error": f"Doctor agent error: {e}"}
+        return
+    _store_reply(session, reply, severity_flag, state)
+    state["reply"] = {"reply": reply, "end_convo": severity_flag}
+
+def _schedule_reply(session, state, priority):
+    """Generate the doctor reply in the background (after a fast-path escalation)."""
+    task = asyncio.create_task(_run_reply(session, state, priority))
+    state["reply_task"] = task
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.get("/api/reply/{session_id}")
+async def get_reply(session_id: str, wait: float = 0, current_user: dict = Depends(get_current_user)):
+    """
+    Doctor reply that followed an escalation. With ?wait=N (seconds, max 30)
+    the call long-polls until it is ready.
+    """
+    session = _find_session(session_id, current_user)
+    if not session or not session.triage or not session.triage["reply_task"]:
+        raise HTTPException(status_code=404, detail="No pending reply for this session")
+    state = session.triage
+    if wait > 0 and not state["reply_task"].done():
+        try:
+            await asyncio.wait_for(asyncio.shield(state["reply_task"]), timeout=min(wait, 30))
+        except asyncio.TimeoutError:
+            pass
+    if state["reply"] is None:
+        return {"status": "pending", "turn": state["turn"]}
+    if "error" in state["reply"]:
+        return {"status": "error", "turn": state["turn"], "detail": state["reply"]["error"]}
+    return dict(state["reply"], status="ready", turn=state["turn"])
+
+@app.get("/api/triage/{session_id}")
+async def get_triage(session_id: str, wait: float = 0, current_user: dict = Depends(get_current_user)):
+    """
+    Latest triage for a session. With ?wait=N (seconds, max 30) the call
+    long-polls until the background job finishes.
+    """
+    session = _find_session(session_id, current_user)
+    if not session or not session.triage:
+        raise HTTPException(status_code=404, detail="Session not found")
+    state = session.triage
+    if wait > 0 and not state["task"].done():
+        try:
+            await asyncio.wait_for(asyncio.shield(state["task"]), timeout=min(wait, 30))
+        except asyncio.TimeoutError:
+            pass
+    return _triage_view(state)
+
+@app.get("/api/sessions/stats")
+async def session_stats(current_user: dict = Depends(get_current_user)):
+    """Occupancy of the in-memory session store and history compaction counters."""
+    SESSIONS.evict()
+    return dict(SESSIONS.stats(), history=HISTORY.stats())
+
+@app.get("/api/guidelines/search")
+async def search_guidelines(q: str, k: int = 3, current_user: dict = Depends(get_current_user)):
+    """Top-k encyclopedia passages (BM25) for a free-text query."""
+    return {"results": retrieve(q, max(1, min(k, 20)))}
+
+TRIAGE_BATCH_MAX = int(os.getenv("TRIAGE_BATCH_MAX", 50000))
+
+def _triage_records(records):
+    """Rule triage + guideline check for a batch; guideline lookups share one snapshot."""
+    results = evaluate_triage_batch(records)
+    ok = [i for i, r in enumerate(results) if not r.get("error")]
+    verified = verify_many([(results[i], _guideline_terms(records[i])) for i in ok])
+    for i, v in zip(ok, verified):
+        results[i] = v
+    return results
+
+@app.post("/api/triage/batch")
+async def triage_batch(req: TriageBatchRequest, current_user: dict = Depends(get_current_user)):
+    """Rule-based triage + guideline check for many structured records at once (no LLM involved)."""
+    if len(req.records) > TRIAGE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {TRIAGE_BATCH_MAX} records per batch")
+    # large batches are pure CPU work — keep them off the event loop
+    if len(req.records) > 100:
+        results = await run_in_threadpool(_triage_records, req.records)
+    else:
+        results = _triage_records(req.records)
+    return {"count": len(results), "results": results}
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events version of /api/chat.
+    Emits `token` events as the doctor reply is generated, a `reply` event with
+    the final cleaned text, then a `triage` event once extraction + triage finish.
+    A red flag in the message first emits an `escalation` event, before any token.
+    """
+    session = _open_session(req.session_id, current_user)
+    alert = _fast_triage(req.message)
+    priority = _chat_priority(session, alert)
+    _admit(priority)
+    _append_turn(session, "user", req.message)
+    state = _schedule_triage(session, alert)
+
+    async def events():
+        if alert:
+            yield _sse("escalation", {"text": escalation_text(alert), "triage": _triage_view(state)["triage"]})
+        reply, severity_flag = "", False
+        digest, messages = HISTORY.window(session)
+        with STAGE_SECONDS.time(stage="doctor_reply_stream"):
+            async for ev in doctor_reply_stream(messages, cache=session.prompt_cache, priority=priority,
+                                                digest=digest):
+                if ev["type"] == "token":
+                    yield _sse("token", {"text": ev["text"]})
+                else:
+                    reply, severity_flag = ev["reply"], ev["end_convo"]
+
+        _store_reply(session, reply, severity_flag, state)
+        yield _sse("reply", {"reply": reply, "end_convo": severity_flag})
+
+        await asyncio.shield(state["task"])
+        yield _sse("triage", _triage_view(state))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class _ChatSocket:
+    """
+    One authenticated /ws/chat connection. Messages for different sessions run
+    concurrently; messages for the same session are answered in order.
+    Frames are sent one at a time so concurrent turns never interleave mid-frame.
+    The connection lives only as long as its token (`expires_at`, the JWT exp).
+    """
+
+    def __init__(self, ws, user, expires_at=None):
+        self.ws = ws
+        self.user = user
+        self.expires_at = expires_at
+        self._send_lock = asyncio.Lock()
+        self._session_locks = {}
+        self._tasks = set()
+
+    async def send(self, frame):
+        async with self._send_lock:
+            await self.ws.send_json(frame)
+
+    def submit(self, msg):
+        task = asyncio.create_task(self._turn(msg))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _turn(self, msg):
+        sid = msg.get("session_id")
+        if not isinstance(sid, str) or not sid or not isinstance(msg.get("message"), str):
+            await self.send({"type": "error", "session_id": sid, "status": 422,
+                             "detail": "Expected {session_id, message}"})
+            return
+        lock = self._session_locks.setdefault(sid, asyncio.Lock())
+        async with lock:
+            try:
+                await self._chat(sid, msg["message"])
+            except HTTPException as e:
+                frame = {"type": "error", "session_id": sid, "status": e.status_code, "detail": e.detail}
+                if e.headers and "Retry-After" in e.headers:
+                    frame["retry_after"] = int(e.headers["Retry-After"])
+                await self.send(frame)
+            except WebSocketDisconnect:
+                pass
+            except Exception as e:
+                print(f"❌ Doctor agent error: {e}")
+                await self.send({"type": "error", "session_id": sid, "status": 500,
+                                 "detail": f"Doctor agent error: {e}"})
+
+    async def _chat(self, sid, message):
+        session = _open_session(sid, self.user)
+        alert = _fast_triage(message)
+        priority = _chat_priority(session, alert)
+        _admit(priority)
+        _append_turn(session, "user", message)
+        state = _schedule_triage(session, alert)
+        if alert:
+            await self.send({"type": "escalation", "session_id": sid, "turn": state["turn"],
+                             "text": escalation_text(alert), "triage": _triage_view(state)["triage"]})
+        # triage is pushed whenever it finishes, before or after the reply
+        triage_push = asyncio.create_task(self._push_triage(sid, state))
+        self._tasks.add(triage_push)
+        triage_push.add_done_callback(self._tasks.discard)
+
+        reply, severity_flag = "", False
+        digest, messages = HISTORY.window(session)
+        with STAGE_SECONDS.time(stage="doctor_reply_stream"):
+            async for ev in doctor_reply_stream(messages, cache=session.prompt_cache, priority=priority,
+                                                digest=digest):
+                if ev["type"] == "token":
+                    await self.send({"type": "token", "session_id": sid, "turn": state["turn"], "text": ev["text"]})
+                else:
+                    reply, severity_flag = ev["reply"], ev["end_convo"]
+
+        _store_reply(session, reply, severity_flag, state)
+        await self.send({"type": "reply", "session_id": sid, "turn": state["turn"], "reply": reply})
+        if severity_flag:
+            await self.send({"type": "end_convo", "session_id": sid, "turn": state["turn"]})
+
+    async def _push_triage(self, sid, state):
+        await asyncio.shield(state["task"])
+        try:
+            await self.send(dict(_triage_view(state), type="triage", session_id=sid))
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # client already gone
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+async def _ws_authenticate(ws, token):
+    """The token from ?token= or a first {"type": "auth", "token"} frame (keeps it out of URLs)."""
+    if not token:
+        first = await ws.receive_json()
+        token = first.get("token") if isinstance(first, dict) and first.get("type") == "auth" else None
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+    user = await get_current_user(token)
+    from jose import jwt, JWTError
+    try:
+        # the signature was verified by get_current_user; only the expiry is needed here
+        return user, jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+@app.websocket("/ws/chat")
+async def chat_socket(ws: WebSocket, token: str = None):
+    """
+    Chat over one WebSocket: authenticated once, any number of session ids.
+    Client sends {"session_id", "message"}; the server pushes `escalation`, `token`,
+    `reply`, `end_convo`, `triage` and `error` frames, each tagged with its session_id.
+    """
+    await ws.accept()
+    try:
+        user, expires_at = await _ws_authenticate(ws, token)
+    except HTTPException as e:
+        await ws.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    except (WebSocketDisconnect, ValueError):
+        return
+
+    conn = _ChatSocket(ws, user, expires_at)
+    await conn.send({"type": "ready", "email": user["email"]})
+    try:
+        while True:
+            try:
+                remaining = conn.expires_at - time.time() if conn.expires_at else None
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError
+                msg = await asyncio.wait_for(ws.receive_json(), timeout=remaining)
+            except asyncio.TimeoutError:
+                await ws.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                break
+            except ValueError:
+                await conn.send({"type": "error", "status": 400, "detail": "Frames must be JSON"})
+                continue
+            if not isinstance(msg, dict):
+                await conn.send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                continue
+            conn.submit(msg)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        conn.close()
 
 # ----------------------------------------
 # Summaries & Diagnosis
 # ----------------------------------------
+HISTORY_PAGE_MAX = 100
+
+def _encode_cursor(doc):
+    return f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+
+def _decode_cursor(cursor):
+    from bson import ObjectId
+    try:
+        ts, oid = cursor.split("|")
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def _history_page(coll, email, text_field, fallback, limit, before):
+    """
+    Newest-first keyset pagination over (timestamp, _id), served by the
+    (user_email, timestamp, _id) index. Conversation bodies are never loaded.
+    """
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    query = {"user_email": email}
+    if before:
+        ts, oid = _decode_cursor(before)
+        query["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]
+
+    cursor = coll.find(query, {text_field: 1, "timestamp": 1}).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1)
+    with MONGO_SECONDS.time(op="history_page"):
+        docs = await cursor.to_list(length=limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    history = [{
+        "_id": str(doc["_id"]),
+        text_field: doc.get(text_field, fallback),
+        "timestamp": doc.get("timestamp")
+    } for doc in docs]
+    next_cursor = _encode_cursor(docs[-1]) if has_more and docs[-1].get("timestamp") else None
+    return {"history": history, "next_cursor": next_cursor}
+
 @app.get("/api/summaries")
-async def get_user_summaries(current_user: dict = Depends(get_current_user)):
-    email = current_user["email"]
-    cursor = summaries.find({"user_email": email}).sort("timestamp", -1)
-    history = []
-    async for doc in cursor:
-        history.append({
-            "_id": str(doc["_id"]),
-            "summary_text": doc.get("summary_text", "No summary"),
-            "timestamp": doc.get("timestamp")
-        })
-    return {"history": history}
+async def get_user_summaries(limit: int = 20, before: str = None, current_user: dict = Depends(get_current_user)):
+    """Summary list for the sidebar. Pass `next_cursor` back as ?before= for the next page."""
+    return await _history_page(summaries, current_user["email"], "summary_text", "No summary", limit, before)
+
+@app.get("/api/diagnoses")
+async def get_user_diagnoses(limit: int = 20, before: str = None, current_user: dict = Depends(get_current_user)):
+    return await _history_page(diagnoses, current_user["email"], "diagnosis_text", "No diagnosis", limit, before)
 
 @app.get("/api/summaries/{summary_id}")
 async def get_single_summary(summary_id: str, current_user: dict = Depends(get_current_user)):
     from bson import ObjectId
-    doc = await summaries.find_one({"_id": ObjectId(summary_id)})
+    from bson.errors import InvalidId
+    try:
+        oid = ObjectId(summary_id)
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Summary not found")
+    with MONGO_SECONDS.time(op="find_summary"):
+        doc = await summaries.find_one({"_id": oid, "user_email": current_user["email"]})
     if not doc:
         raise HTTPException(status_code=404, detail="Summary not found")
     doc["_id"] = str(doc["_id"])
     return doc
 
+REPORT_CACHE = ResultCache(REPORT_CACHE_SIZE)
+
+def _message_log(session_id, current_user):
+    """Conversation for the summary / diagnosis agents."""
+    session = _find_session(session_id, current_user)
+    return session.message_log() if session else []
+
+def _report_key(email, message_logs):
+    return content_key("case_report", REPORT_MODEL_NAME, email, message_logs)
+
+async def _stored_report(email, message_logs):
+    """The combined case report already saved for exactly this conversation, if any."""
+    with MONGO_SECONDS.time(op="find_report"):
+        return await summaries.find_one(
+            {"user_email": email, "conversation_key": _report_key(email, message_logs)},
+            {"conversation": 0}, sort=[("timestamp", -1)],
+        )
+
 @app.post("/api/generate_summary")
-async def generate_summary_api(current_user: dict = Depends(get_current_user)):
-    global message_logs
+async def generate_summary_api(session_id: str = None, current_user: dict = Depends(get_current_user)):
+    message_logs = _message_log(session_id, current_user)
     if not message_logs or len(message_logs) < 2:
         return {"summary": "No conversation found yet."}
     try:
-        from summary_agent import generate_summary
-        summary_text = generate_summary(message_logs)
-        summary_doc = {
-            "user_email": current_user["email"],
-            "timestamp": datetime.utcnow(),
-            "summary_text": summary_text,
-            "conversation": message_logs
-        }
-        result = await summaries.insert_one(summary_doc)
-        return {"summary": summary_text, "saved": True, "id": str(result.inserted_id)}
+        async def compute():
+            report = await _stored_report(current_user["email"], message_logs)
+            if report:
+                return {"summary": report["summary_text"], "saved": True, "id": str(report["_id"])}
+            _admit("report")
+            summary_text = await generate_summary(message_logs)
+            summary_doc = {
+                "user_email": current_user["email"],
+                "timestamp": datetime.utcnow(),
+                "summary_text": summary_text,
+                "conversation": message_logs
+            }
+            with MONGO_SECONDS.time(op="insert_summary"):
+                result = await summaries.insert_one(summary_doc)
+            return {"summary": summary_text, "saved": True, "id": str(result.inserted_id)}
+
+        # repeated clicks on an unchanged conversation reuse one generation + one saved doc
+        key = content_key("summary", REPORT_MODEL_NAME, current_user["email"], message_logs)
+        return await REPORT_CACHE.get_or_compute(
+            key, compute, cacheable=lambda r: not r["summary"].startswith(SUMMARY_ERRORS)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate_diagnosis")
-async def generate_differential_diagnosis_api(current_user: dict = Depends(get_current_user)):
-    global message_logs
+async def generate_differential_diagnosis_api(session_id: str = None, current_user: dict = Depends(get_current_user)):
+    message_logs = _message_log(session_id, current_user)
     if not message_logs or len(message_logs) < 2:
         return {"diagnosis": "⚠ Please have a conversation first."}
     try:
-        from differential_diagnosis import generate_differential_diagnosis
-        diagnosis_text = generate_differential_diagnosis(message_logs)
-        diagnosis_doc = {
-            "user_email": current_user["email"],
-            "timestamp": datetime.utcnow(),
-            "diagnosis_text": diagnosis_text,
-            "conversation": message_logs
-        }
-        await diagnoses.insert_one(diagnosis_doc)
-        return {"diagnosis": diagnosis_text, "saved": True}
+        async def compute():
+            report = await _stored_report(current_user["email"], message_logs)
+            if report:
+                return {"diagnosis": report["diagnosis_text"], "saved": True}
+            _admit("report")
+            diagnosis_text = await generate_differential_diagnosis(message_logs)
+            diagnosis_doc = {
+                "user_email": current_user["email"],
+                "timestamp": datetime.utcnow(),
+                "diagnosis_text": diagnosis_text,
+                "conversation": message_logs
+            }
+            with MONGO_SECONDS.time(op="insert_diagnosis"):
+                await diagnoses.insert_one(diagnosis_doc)
+            return {"diagnosis": diagnosis_text, "saved": True}
+
+        key = content_key("diagnosis", REPORT_MODEL_NAME, current_user["email"], message_logs)
+        return await REPORT_CACHE.get_or_compute(
+            key, compute, cacheable=lambda r: not r["diagnosis"].startswith(DIAGNOSIS_ERRORS)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/generate_report")
+async def generate_case_report_api(session_id: str = None, current_user: dict = Depends(get_current_user)):
+    """
+    Summary, top-5 differential and structured record from one LLM call, saved as one
+    summary document. /api/generate_summary and /api/generate_diagnosis then serve from it.
+    """
+    message_logs = _message_log(session_id, current_user)
+    if not message_logs or len(message_logs) < 2:
+        return {"error": "No conversation found yet."}
+    email = current_user["email"]
+    try:
+        def response(doc):
+            return {
+                "id": str(doc["_id"]),
+                "summary": doc["summary_text"],
+                "diagnosis": doc["diagnosis_text"],
+                "differential": doc["differential"],
+                "structured": doc["structured"],
+                "saved": True,
+            }
+
+        async def compute():
+            stored = await _stored_report(email, message_logs)
+            if stored:
+                return response(stored)
+            _admit("report")
+            report = await generate_case_report(message_logs)
+            if "error" in report:
+                return {"error": report["error"], "saved": False}
+            report_doc = {
+                "user_email": email,
+                "timestamp": datetime.utcnow(),
+                "summary_text": report["summary"],
+                "diagnosis_text": format_differential(report["differential"]),
+                "differential": report["differential"],
+                "structured": report["structured"],
+                "conversation_key": _report_key(email, message_logs),
+                "conversation": message_logs
+            }
+            with MONGO_SECONDS.time(op="insert_report"):
+                result = await summaries.insert_one(report_doc)
+            report_doc["_id"] = result.inserted_id
+            return response(report_doc)
+
+        return await REPORT_CACHE.get_or_compute(
+            _report_key(email, message_logs), compute, cacheable=lambda r: "error" not in r
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/reports/cache_stats")
+async def report_cache_stats(current_user: dict = Depends(get_current_user)):
+    return REPORT_CACHE.stats()
+
+metrics.Gauge("carebot_llm_queue_depth", "LLM requests waiting for a scheduler slot",
+              lambda: llm_client.SCHEDULER.depth())
+metrics.Gauge("carebot_llm_running", "LLM requests in flight", lambda: llm_client.SCHEDULER.stats()["running"])
+metrics.Gauge("carebot_sessions", "Chat sessions in memory", lambda: len(SESSIONS))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition (unauthenticated, for the scraper)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/llm/stats")
+async def llm_stats(current_user: dict = Depends(get_current_user)):
+    """Scheduler queue depth, per-priority wait times and per-model slots."""
+    return llm_client.stats()
+
 # ----------------------------------------
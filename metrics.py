@@ -0,0 +1,135 @@
+# metrics.py
+import bisect, time
+from contextlib import contextmanager
+
+# Prometheus text exposition without the client library: histograms, counters
+# and gauges read at scrape time. Everything runs on the event loop, so no locks.
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (+inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a block (await inside it is fine)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value computed at scrape time by `fn()`."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            return [f"{self.name} {self.fn()}"]
+        except Exception:
+            return []
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# -----------------------------
+# Shared metrics
+# -----------------------------
+STAGE_SECONDS = Histogram("carebot_stage_seconds", "Time spent per pipeline stage", ["stage"])
+MONGO_SECONDS = Histogram("carebot_mongo_seconds", "MongoDB call latency", ["op"])
+
+LLM_REQUEST_SECONDS = Histogram("carebot_llm_request_seconds",
+                                "Wall time of Ollama calls, scheduler wait excluded", ["agent", "model"])
+LLM_PROMPT_EVAL_SECONDS = Histogram("carebot_llm_prompt_eval_seconds",
+                                    "Ollama prompt_eval_duration (prefill)", ["agent", "model"])
+LLM_EVAL_SECONDS = Histogram("carebot_llm_eval_seconds", "Ollama eval_duration (decode)", ["agent", "model"])
+LLM_PROMPT_TOKENS = Counter("carebot_llm_prompt_tokens_total", "Ollama prompt_eval_count", ["agent", "model"])
+LLM_EVAL_TOKENS = Counter("carebot_llm_eval_tokens_total", "Ollama eval_count", ["agent", "model"])
+
+
+def observe_ollama(agent, model, body, elapsed):
+    """Record one finished Ollama call (a non-stream body or the final stream chunk)."""
+    labels = {"agent": agent or "other", "model": model}
+    LLM_REQUEST_SECONDS.observe(elapsed, **labels)
+    if not body:
+        return  # stream closed before the final chunk
+    if body.get("prompt_eval_duration") is not None:
+        LLM_PROMPT_EVAL_SECONDS.observe(body["prompt_eval_duration"] / 1e9, **labels)
+    if body.get("eval_duration") is not None:
+        LLM_EVAL_SECONDS.observe(body["eval_duration"] / 1e9, **labels)
+    LLM_PROMPT_TOKENS.inc(body.get("prompt_eval_count") or 0, **labels)
+    LLM_EVAL_TOKENS.inc(body.get("eval_count") or 0, **labels)
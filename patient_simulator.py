@@ -1,65 +1,66 @@
-import json, os, random, time
+import json, os, random, time, asyncio
 from symptom_extractor import extract_structured
+from vignette_store import VignetteStore, VIGNETTES_STORE
 
-VIGNETTES_FILE = "data/vignettes.json"
+VIGNETTES_FILE = "data/vignettes.json"  # hand-written seed cases, imported into the store once
+
+NAMES = ["John Doe", "Jane Smith", "Alice", "Bob", "Charlie"]
+COMPLAINTS = ["chest pain", "headache", "fever", "cough", "stomach ache"]
+SEVERITIES = ["mild", "moderate", "severe"]
+VITALS_LIST = [
+    {"hr": 80, "bp": "120/80", "temp": 36.8},
+    {"hr": 100, "bp": "130/85", "temp": 37.5},
+    {"hr": 140, "bp": "90/60", "temp": 39.0},
+]
+SYMPTOMS = ["nausea", "dizziness", "fatigue", "shortness of breath"]
+HISTORIES = [
+    "No significant past medical history.",
+    "History of hypertension.",
+    "History of diabetes."
+]
+
+def random_patient(rng=random, patient_id=None):
+    """One synthetic vignette. Pass a seeded random.Random for reproducible cohorts."""
+    return {
+        "id": patient_id if patient_id is not None else int(time.time() * 1000),
+        "name": rng.choice(NAMES),
+        "age": rng.randint(20, 70),
+        "chief_complaint": rng.choice(COMPLAINTS),
+        "severity": rng.choice(SEVERITIES),
+        "vitals": dict(rng.choice(VITALS_LIST)),
+        "associated_symptoms": rng.sample(SYMPTOMS, k=rng.randint(0, 2)),
+        "history": rng.choice(HISTORIES)
+    }
 
 class PatientSimulator:
-    def __init__(self):
+    def __init__(self, store_path=VIGNETTES_STORE):
         os.makedirs("data", exist_ok=True)
-        # load existing vignettes if exist
-        if os.path.exists(VIGNETTES_FILE):
+        self.store = VignetteStore(store_path)
+        # first run: seed the append-only store with the bundled vignettes
+        if not len(self.store) and os.path.exists(VIGNETTES_FILE):
             with open(VIGNETTES_FILE, "r", encoding="utf-8") as f:
-                self.vignettes = json.load(f)
-        else:
-            self.vignettes = []
+                self.store.append_many(json.load(f))
 
     def generate_patient(self):
-        names = ["John Doe", "Jane Smith", "Alice", "Bob", "Charlie"]
-        complaints = ["chest pain", "headache", "fever", "cough", "stomach ache"]
-        severities = ["mild", "moderate", "severe"]
-        vitals_list = [
-            {"hr": 80, "bp": "120/80", "temp": 36.8},
-            {"hr": 100, "bp": "130/85", "temp": 37.5},
-            {"hr": 140, "bp": "90/60", "temp": 39.0},
-        ]
-
-        patient = {
-            "id": int(time.time() * 1000),
-            "name": random.choice(names),
-            "age": random.randint(20, 70),
-            "chief_complaint": random.choice(complaints),
-            "severity": random.choice(severities),
-            "vitals": random.choice(vitals_list),
-            "associated_symptoms": random.sample(
-                ["nausea", "dizziness", "fatigue", "shortness of breath"],
-                k=random.randint(0, 2)
-            ),
-            "history": random.choice([
-                "No significant past medical history.",
-                "History of hypertension.",
-                "History of diabetes."
-            ])
-        }
-        return patient
+        return random_patient()
 
     def save_patient_to_vignettes(self, patient):
-        self.vignettes.append(patient)
-        with open(VIGNETTES_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.vignettes, f, indent=2, ensure_ascii=False)
+        self.store.append(patient)
 
     def get_random_patient(self):
-        if not self.vignettes:
+        if not len(self.store):
             patient = self.generate_patient()
             self.save_patient_to_vignettes(patient)
-        return random.choice(self.vignettes)
+        return self.store.sample()
 
-    def simulate_conversation(self, patient, num_turns=3):
+    def build_conversation(self, patient, num_turns=3):
+        """Scripted consultation for a vignette, without any LLM call. Returns (conversation_text, message_history)."""
         conversation_lines = [
             f"Patient: Hi, I am {patient['name']}, {patient['age']} years old.",
             f"Chief Complaint: {patient['chief_complaint']}",
             f"History: {patient['history']}",
             f"Vitals: {json.dumps(patient['vitals'])}",
-            f"Symptoms: {', '.join(patient.get('associated_symptoms', []))}"
+            f"Symptoms: {', '.join(patient.get('associated_symptoms') or patient.get('symptoms', []))}"
         ]
 
         follow_ups = [
@@ -75,7 +76,6 @@ class PatientSimulator:
             conversation_lines.append(f"Patient: {random.choice(['Mild', 'Moderate', 'Severe', 'Not sure'])}")
 
         conversation_text = "\n".join(conversation_lines)
-        structured = extract_structured(conversation_text)
 
         message_history = []
         for line in conversation_text.split("\n"):
@@ -84,6 +84,11 @@ class PatientSimulator:
             elif line.startswith("Doctor:"):
                 message_history.append({"role": "assistant", "content": line[len("Doctor: "):]})
 
+        return conversation_text, message_history
+
+    def simulate_conversation(self, patient, num_turns=3):
+        conversation_text, message_history = self.build_conversation(patient, num_turns)
+        structured = asyncio.run(extract_structured(conversation_text))
         return message_history, structured
 
 
@@ -0,0 +1,63 @@
+# result_cache.py
+import asyncio, hashlib, json
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """Stable hash of JSON-serialisable parts (conversation, model, ...)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache for async results, with single-flight:
+    concurrent calls for the same key share one in-flight computation.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    async def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        """
+        Return the cached value for `key`, join an in-flight call for it, or run `compute()`.
+        Results rejected by `cacheable` (e.g. error messages) are returned but not stored.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        if key in self._inflight:
+            self.merged += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        try:
+            # shield: one caller disconnecting must not cancel the others' result
+            value = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+
+        if cacheable(value):
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "merged": self.merged,
+        }
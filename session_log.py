@@ -0,0 +1,177 @@
+# session_log.py
+import asyncio, glob, gzip, json, os, shutil, time
+from metrics import STAGE_SECONDS
+from utils import LOG_DIR, LOG_FLUSH_INTERVAL, LOG_BATCH_SIZE, LOG_SEGMENT_MAX_BYTES
+
+# Segments are per-day, per-worker JSONL files: logs/20250101-p4242-000.jsonl,
+# -001 after rotation, ... Each worker process only ever writes its own files.
+# Closed segments are gzip-compressed to .jsonl.gz.
+
+
+def _segment_path(directory, day, worker, seq):
+    return os.path.join(directory, f"{day}-{worker}-{seq:03d}.jsonl")
+
+
+def _segments(directory):
+    """All segment files (plain or compressed), oldest first."""
+    paths = glob.glob(os.path.join(directory, "*-*.jsonl")) + glob.glob(os.path.join(directory, "*-*.jsonl.gz"))
+    return sorted(paths, key=lambda p: os.path.basename(p).split(".")[0])
+
+
+def _compress(path):
+    # append as a new gzip member: an existing .gz is never overwritten
+    with open(path, "rb") as src, gzip.open(path + ".gz", "ab") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+
+
+class SessionLogWriter:
+    """
+    Append-only, batched session log.
+    write() only buffers a record; a background task flushes batches to the
+    current day's segment in a worker thread, rotating by size and day.
+    """
+
+    def __init__(self, directory=LOG_DIR, flush_interval=LOG_FLUSH_INTERVAL,
+                 batch_size=LOG_BATCH_SIZE, segment_max_bytes=LOG_SEGMENT_MAX_BYTES, worker=None):
+        self.directory = directory
+        self._worker = worker
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.segment_max_bytes = segment_max_bytes
+        self._buffer = []
+        self._task = None
+        self._wake = None
+        self._lock = None
+        self._current = None  # (day, seq) of this worker's open segment
+
+    @property
+    def worker(self):
+        """Segment name tag; the pid by default, read at write time so forked workers differ."""
+        return self._worker or f"p{os.getpid()}"
+
+    def write(self, session_id, kind, **fields):
+        """Queue one record. Never touches the disk on the caller's path."""
+        self._buffer.append({"sid": session_id, "ts": time.time(), "kind": kind, **fields})
+        self._ensure_started()
+        if len(self._buffer) >= self.batch_size and self._wake:
+            self._wake.set()
+
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop (plain script) — records stay buffered until close()
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Session log flush error: {e}")
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        async with self._lock:
+            with STAGE_SECONDS.time(stage="log_write"):
+                await asyncio.to_thread(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        os.makedirs(self.directory, exist_ok=True)
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in batch)
+        path = self._open_segment()
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _open_segment(self):
+        """Path of the segment to append to, rotating + compressing the previous one if needed."""
+        day = time.strftime("%Y%m%d")
+        if self._current is None or self._current[0] != day:
+            previous = self._current
+            prefix = f"{day}-{self.worker}-"
+            names = [os.path.basename(p) for p in _segments(self.directory)
+                     if os.path.basename(p).startswith(prefix)]
+            seq = 0
+            if names:
+                seq = int(names[-1][len(prefix):].split(".")[0])
+                if names[-1].endswith(".gz"):
+                    seq += 1  # never append to a segment that was already closed
+            self._current = (day, seq)
+            if previous:
+                self._close_segment(*previous)
+
+        path = _segment_path(self.directory, day, self.worker, self._current[1])
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            self._close_segment(*self._current)
+            self._current = (day, self._current[1] + 1)
+            path = _segment_path(self.directory, day, self.worker, self._current[1])
+        return path
+
+    def _close_segment(self, day, seq):
+        path = _segment_path(self.directory, day, self.worker, seq)
+        if os.path.exists(path):
+            _compress(path)
+
+    def compress_old(self):
+        """Compress leftover plain segments from earlier days (e.g. after a crash)."""
+        today = time.strftime("%Y%m%d")
+        for path in _segments(self.directory):
+            if path.endswith(".jsonl") and not os.path.basename(path).startswith(today + "-"):
+                _compress(path)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        await self.flush()
+
+
+def read_session(session_id, directory=LOG_DIR):
+    """
+    Rebuild one session from the log segments.
+    Returns {"session_id", "turns": [{"role", "content"}], "structured", "triage"} or None.
+    """
+    turns, latest = {}, None
+    for path in _segments(directory):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if session_id not in line:
+                    continue  # cheap pre-filter before parsing
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line after a crash
+                if rec.get("sid") != session_id:
+                    continue
+                if rec["kind"] == "turn":
+                    turns[rec["n"]] = {"role": rec["role"], "content": rec["content"]}
+                elif rec["kind"] == "triage" and (latest is None or rec["turn"] >= latest["turn"]):
+                    latest = rec
+
+    if not turns and latest is None:
+        return None
+    return {
+        "session_id": session_id,
+        "turns": [turns[n] for n in sorted(turns)],
+        "structured": latest.get("structured") if latest else None,
+        "triage": latest.get("triage") if latest else None,
+    }
@@ -0,0 +1,159 @@
+# session_store.py
+import sys, time
+from collections import OrderedDict
+from utils import SESSION_MAX, SESSION_IDLE_TTL, SESSION_MAX_TURNS, SESSION_MAX_BYTES
+
+# Display names used by the summary / diagnosis agents
+LOG_ROLES = {"user": "patient", "assistant": "doctor"}
+
+
+class Turn:
+    """One chat message. Slotted, with an interned role string."""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = content
+
+
+class Session:
+    """
+    In-memory state for one consultation, owned by a single user.
+    `total` counts every turn ever appended, so absolute positions stay
+    valid after old turns are trimmed.
+    """
+    __slots__ = ("id", "owner", "turns", "total", "bytes", "last_active",
+                 "extraction", "prompt_cache", "triage", "digest")
+
+    def __init__(self, sid, owner):
+        self.id = sid
+        self.owner = owner
+        self.turns = []
+        self.total = 0
+        self.bytes = 0
+        self.last_active = time.monotonic()
+        self.extraction = None   # {"record": dict, "upto": absolute turn count}
+        self.prompt_cache = {}   # see doctor_agent._cached_prompt
+        self.triage = None       # latest background triage job (see main._schedule_triage)
+        self.digest = None       # rolling summary of older turns (see history_manager.py)
+
+    def history(self):
+        """Messages as {"role", "content"} dicts for the doctor agent."""
+        return [{"role": t.role, "content": t.content} for t in self.turns]
+
+    def message_log(self):
+        """Messages as {"role": patient/doctor, "message"} dicts for summary + diagnosis."""
+        return [{"role": LOG_ROLES.get(t.role, t.role), "message": t.content} for t in self.turns]
+
+
+class SessionStore:
+    """
+    Bounded session map with LRU + idle-TTL eviction and per-session size caps.
+    Sessions are ordered by last activity, so expiry only ever inspects the oldest.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, idle_ttl=SESSION_IDLE_TTL,
+                 max_turns=SESSION_MAX_TURNS, max_bytes=SESSION_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._latest = {}  # owner -> most recently active session id
+        self._turns = 0
+        self._bytes = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.trimmed_turns = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, sid):
+        return sid in self._sessions
+
+    def _touch(self, session):
+        session.last_active = time.monotonic()
+        self._sessions.move_to_end(session.id)
+        self._latest[session.owner] = session.id
+
+    def _drop(self, sid):
+        session = self._sessions.pop(sid)
+        self._turns -= len(session.turns)
+        self._bytes -= session.bytes
+        if self._latest.get(session.owner) == sid:
+            del self._latest[session.owner]
+
+    def evict(self):
+        """Drop idle sessions, then least-recently-used ones above the cap."""
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_active >= cutoff:
+                break
+            self._drop(oldest.id)
+            self.evicted_idle += 1
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)))
+            self.evicted_lru += 1
+
+    def get(self, sid, owner):
+        """Return the caller's session, or None if it doesn't exist or belongs to someone else."""
+        self.evict()
+        session = self._sessions.get(sid)
+        if session is None or session.owner != owner:
+            return None
+        self._touch(session)
+        return session
+
+    def open(self, sid, owner):
+        """Get or create a session. Raises PermissionError if another user owns `sid`."""
+        self.evict()
+        session = self._sessions.get(sid)
+        if session is None:
+            session = self._sessions[sid] = Session(sid, owner)
+            self.evict()
+        elif session.owner != owner:
+            raise PermissionError(f"Session {sid} belongs to another user")
+        self._touch(session)
+        return session
+
+    def latest(self, owner):
+        """The owner's most recently active session, if any."""
+        sid = self._latest.get(owner)
+        return self.get(sid, owner) if sid else None
+
+    def append(self, session, role, content):
+        """Add a turn, trimming the oldest ones past the turn / byte caps."""
+        size = len(content.encode("utf-8"))
+        session.turns.append(Turn(role, content))
+        session.total += 1
+        session.bytes += size
+        # evicted while a reply was being generated — keep the object consistent, skip the store
+        if self._sessions.get(session.id) is not session:
+            return
+        self._turns += 1
+        self._bytes += size
+
+        while len(session.turns) > 1 and (
+            len(session.turns) > self.max_turns or session.bytes > self.max_bytes
+        ):
+            old = session.turns.pop(0)
+            size = len(old.content.encode("utf-8"))
+            session.bytes -= size
+            self._turns -= 1
+            self._bytes -= size
+            self.trimmed_turns += 1
+        self._touch(session)
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "turns": self._turns,
+            "bytes": self._bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+            "trimmed_turns": self.trimmed_turns,
+        }
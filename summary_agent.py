@@ -1,11 +1,12 @@
 # summary_agent.py
-import requests
 import json
+import llm_client
+from utils import REPORT_MODEL_NAME
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "mistral:latest"  
+# Replies that signal a failure rather than a summary (not worth caching)
+ERROR_PREFIXES = ("No valid conversation", "No summary generated", "Error generating summary")
 
-def generate_summary(conversation):
+async def generate_summary(conversation):
     """
     Takes a list of messages (dicts) and returns a short, structured medical summary.
     """
@@ -32,15 +33,7 @@ def generate_summary(conversation):
         Summary:
         """
 
-        payload = {
-            "model": MODEL_NAME,
-            "prompt": prompt,
-            "stream": False
-        }
-
-        res = requests.post(OLLAMA_URL, json=payload)
-        res.raise_for_status()
-        data = res.json()
+        data = await llm_client.generate(prompt, model=REPORT_MODEL_NAME, timeout=180, priority="report", agent="summary")
 
         return data.get("response", "No summary generated.")
 
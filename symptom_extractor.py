@@ -1,6 +1,7 @@
 # symptom_extractor.py
-import requests, json
-from utils import OLLAMA_URL, MODEL_NAME
+import json
+import llm_client
+from utils import MODEL_NAME
 
 EXTRACTION_INSTRUCTION = """
 Extract these fields from the conversation and return ONLY JSON:
@@ -14,27 +15,45 @@ If missing, use empty strings or empty lists/objects.
 Conversation:
 """
 
-def _call_ollama_simple(prompt):
-    url = f"{OLLAMA_URL}/api/generate"
-    payload = {"model": MODEL_NAME, "prompt": prompt, "max_tokens": 300, "temperature": 0, "stream": False}
-    r = requests.post(url, json=payload, timeout=30)
-    r.raise_for_status()
-    resp = r.json()
+INCREMENTAL_INSTRUCTION = """
+You are updating a structured record of an ongoing consultation.
+Using the record below only as context, extract what the NEW turns say about
+these fields and return ONLY JSON:
+- chief_complaint (string)
+- onset (string)
+- severity (string: mild/moderate/severe)
+- associated_symptoms (array of strings)
+- risk_factors (array of strings)
+- vitals (object)
+Leave a field empty if the new turns don't mention it.
+Record so far:
+"""
+
+LIST_FIELDS = ("associated_symptoms", "risk_factors")
+
+async def _call_ollama_simple(prompt):
+    # the "extractor" profile sets format=json, so the response is a bare JSON document
+    resp = await llm_client.generate(prompt, model=MODEL_NAME, timeout=30, priority="extraction", agent="extractor")
     return resp.get("response") if isinstance(resp, dict) else None
 
-def extract_structured(conversation_text):
+def _parse_json(raw):
+    return json.loads(raw)
+
+async def extract_structured(conversation_text):
+    return (await _extract_full(conversation_text))[0]
+
+async def _extract_full(conversation_text):
+    """(record, True) from the model, or (skeleton record, False) when it gave nothing usable."""
     prompt = EXTRACTION_INSTRUCTION + "\n" + conversation_text + "\n\nReturn JSON now:"
     try:
-        raw = _call_ollama_simple(prompt)
+        raw = await _call_ollama_simple(prompt)
         # Try to parse JSON if model returns JSON
         if raw:
-            raw = raw.strip()
-            # sometimes model returns backticks
-            for c in ("```json\n", "```", "`"):
-                raw = raw.replace(c, "")
-            return json.loads(raw)
-    except Exception:
-        pass
+            record = _parse_json(raw)
+            if isinstance(record, dict):
+                return record, True
+    except Exception as e:
+        print(f"❌ Structured extraction failed, using skeleton record: {e}")
     # fallback: minimal skeleton if parsing fails
     return {
         "chief_complaint": conversation_text[:120],
@@ -43,4 +62,56 @@ def extract_structured(conversation_text):
         "associated_symptoms": [],
         "risk_factors": [],
         "vitals": {}
-    }
+    }, False
+
+
+def merge_structured(previous, update):
+    """
+    Deterministically fold an extraction of new turns into the previous record.
+    - chief_complaint: first non-empty value wins
+    - onset / severity: latest non-empty value wins
+    - list fields: ordered union, de-duplicated case-insensitively
+    - vitals: key-wise, latest non-empty reading wins
+    """
+    merged = dict(previous)
+    merged["chief_complaint"] = previous.get("chief_complaint") or update.get("chief_complaint") or ""
+    for key in ("onset", "severity"):
+        merged[key] = update.get(key) or previous.get(key) or ""
+
+    for key in LIST_FIELDS:
+        items, seen = [], set()
+        for item in list(previous.get(key) or []) + list(update.get(key) or []):
+            norm = str(item).strip().lower()
+            if norm and norm not in seen:
+                seen.add(norm)
+                items.append(item)
+        merged[key] = items
+
+    vitals = dict(previous.get("vitals") or {})
+    new_vitals = update.get("vitals")
+    if isinstance(new_vitals, dict):
+        vitals.update({k: v for k, v in new_vitals.items() if v not in ("", None)})
+    merged["vitals"] = vitals
+    return merged
+
+async def extract_incremental(previous, new_turns_text):
+    """
+    Extract only from the new turns and merge into the previous record.
+    Prompt size stays proportional to the new turns instead of the whole transcript.
+    Returns (record, ok). On failure ok is False and the record is the previous one
+    (or a skeleton on the first turn) — the caller should send these turns again.
+    """
+    if not previous:
+        return await _extract_full(new_turns_text)
+
+    prompt = (INCREMENTAL_INSTRUCTION + json.dumps(previous, ensure_ascii=False)
+              + "\n\nNew turns:\n" + new_turns_text + "\n\nReturn JSON now:")
+    try:
+        raw = await _call_ollama_simple(prompt)
+        if raw:
+            update = _parse_json(raw)
+            if isinstance(update, dict):
+                return merge_structured(previous, update), True
+    except Exception as e:
+        print(f"❌ Incremental extraction failed, keeping previous record: {e}")
+    return previous, False
@@ -0,0 +1,74 @@
+from triage_engine import scan_message, escalation_text, evaluate_triage
+
+# Fast path must escalate whenever a red flag is not plainly negated
+ESCALATE = [
+    "I have crushing chest pain since an hour",
+    "I have never had chest pain this bad before",
+    "Not sleeping well and chest pain",
+    "I can not stop the chest pain",
+    "No, chest pain started an hour ago",
+    "It's not just a cold, I have shortness of breath",
+    "Denies shortness of breath. Now I have chest pain",
+    "no cough but chest pain",
+]
+
+NOT_ESCALATE = [
+    "no chest pain, just a cough",
+    "I have no chest pain",
+    "denies chest pain",
+    "Patient denies any shortness of breath",
+    "without chest pain or fever",
+    "I don't have chest pain",
+    "no more chest pain since yesterday",
+    "My knee hurts",
+]
+
+
+def test_red_flags_escalate():
+    for message in ESCALATE:
+        alert = scan_message(message)
+        assert alert and alert["level"] == "Emergency", message
+
+
+def test_negated_red_flags_ignored():
+    for message in NOT_ESCALATE:
+        assert scan_message(message) is None, message
+
+
+def test_critical_vitals_in_message():
+    assert scan_message("pulse is 142 and I feel dizzy")["level"] == "Emergency"
+    assert scan_message("BP 82/50")["level"] == "Emergency"
+    assert scan_message("temp 104")["level"] == "Emergency"  # Fahrenheit
+    assert scan_message("temperature 39.2 C") is None
+
+
+def test_escalation_text_names_flags():
+    assert "chest pain" in escalation_text(scan_message("sudden chest pain"))
+    assert "reading you reported" in escalation_text(scan_message("BP 82/50"))
+
+
+def test_structured_triage_unchanged():
+    assert evaluate_triage({"chief_complaint": "x", "vitals": {"hr": 140}})["level"] == "Emergency"
+    assert evaluate_triage({"chief_complaint": "chest pain"})["level"] == "Emergency"
+    assert evaluate_triage({"chief_complaint": "mild cough"})["level"] == "Routine"
+
+
+def test_inflected_red_flags():
+    assert evaluate_triage({"chief_complaint": "sudden unconsciousness"})["level"] == "Emergency"
+    assert evaluate_triage({"chief_complaint": "seizures"})["level"] == "Emergency"
+
+
+def test_rules_load_from_any_working_directory():
+    import os, subprocess, sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ("import triage_engine as t; "
+            "print(t.evaluate_triage({'chief_complaint': 'crushing chest pain'})['level'])")
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(here) or "/",
+                         env=dict(os.environ, PYTHONPATH=here), capture_output=True, text=True)
+    assert out.stdout.strip() == "Emergency", out.stderr
+
+
+def test_affirmed_red_flags_skip_negations():
+    from triage_engine import affirmed_red_flags
+    assert affirmed_red_flags(["no chest pain", "I had a seizure"]) == ["seizure"]
+    assert affirmed_red_flags(["denies shortness of breath"]) == []
@@ -1,27 +1,74 @@
 # triage_engine.py
+import json, os, re
+
+TRIAGE_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "triage_rules.json")
+
+
+class KeywordMatcher:
+    """
+    One table of keywords compiled into a single case-insensitive regex.
+    Matches whole words only (a trailing plural "s" is allowed), and
+    reports hits in the table's original order.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = [" ".join(k.lower().split()) for k in keywords]
+        self._order = {k: i for i, k in enumerate(self.keywords)}
+        # longest first so "severe abdominal pain" wins over shorter overlaps
+        alternatives = sorted(self.keywords, key=len, reverse=True)
+        body = "|".join(r"[ \t]+".join(map(re.escape, k.split())) for k in alternatives)
+        self._regex = re.compile(rf"\b(?:{body})s?\b", re.IGNORECASE) if body else None
+
+    def _canonical(self, matched):
+        key = " ".join(matched.lower().split())
+        return key if key in self._order else key[:-1]
+
+    def find(self, texts):
+        """Keywords found in any of `texts`. Texts are scanned in one pass, never across items."""
+        if self._regex is None:
+            return []
+        found = {self._canonical(m.group(0)) for m in self._regex.finditer("\n".join(texts))}
+        return sorted(found, key=self._order.get)
+
+    def spans(self, text):
+        """(keyword, start offset) for every hit in `text`, in text order."""
+        if self._regex is None:
+            return []
+        return [(self._canonical(m.group(0)), m.start()) for m in self._regex.finditer(text)]
+
+
+def load_rules(path=TRIAGE_RULES_PATH):
+    """The keyword tables. Missing or empty tables are an error — never "no red flags"."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Triage rules not found: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    for table in ("red_flags", "urgent_keywords"):
+        if not rules.get(table):
+            raise ValueError(f"Triage rules in {path} have no '{table}' entries")
+    return rules
+
+RULES = load_rules()
+RED_FLAGS = KeywordMatcher(RULES["red_flags"])
+URGENT_KEYWORDS = KeywordMatcher(RULES["urgent_keywords"])
+
+
 def evaluate_triage(struct):
     """
     Enhanced triage evaluation function.
     Returns dict: {"level": "Emergency" | "Urgent" | "Routine", "reason": "..."}
     """
 
-    cc = (struct.get("chief_complaint") or "").lower()
-    assoc = [s.lower() for s in struct.get("associated_symptoms", []) or []]
-    severity = (struct.get("severity") or "").lower()
+    cc = str(struct.get("chief_complaint") or "")
+    texts = [cc] + [str(s) for s in struct.get("associated_symptoms", []) or []]
+    severity = str(struct.get("severity") or "").lower()
     vitals = struct.get("vitals") or {}
 
     # -------------------------
     # 🩺 Red flag keywords
     # -------------------------
-    red_flags = [
-        "chest pain", "shortness of breath", "difficulty breathing",
-        "severe bleeding", "unconscious", "loss of consciousness",
-        "sudden weakness", "slurred speech", "seizure",
-        "altered mental state", "vomiting blood", "severe abdominal pain"
-    ]
-
     # If any red flag symptom is in chief complaint or associated symptoms
-    triggered_flags = [rf for rf in red_flags if rf in cc or any(rf in s for s in assoc)]
+    triggered_flags = RED_FLAGS.find(texts)
     if triggered_flags:
         joined_flags = ", ".join(triggered_flags)
         return {
@@ -39,23 +86,14 @@ def evaluate_triage(struct):
     except:
         hr, sbp, temp = 0, 0, 0.0
 
-    if hr and hr > 130:
-        return {"level": "Emergency", "reason": "⚠️ Very high heart rate (>130 bpm) — possible tachycardia."}
-    if sbp and sbp < 90:
-        return {"level": "Emergency", "reason": "⚠️ Critically low blood pressure (<90 mmHg)."}
-    if temp and temp >= 40:
-        return {"level": "Emergency", "reason": "⚠️ Extremely high fever (≥40°C)."}
+    critical = _critical_vitals(hr, sbp, temp)
+    if critical:
+        return critical
 
     # -------------------------
     # 🟠 Urgent conditions
     # -------------------------
-    urgent_keywords = [
-        "high fever", "severe pain", "infection", "dehydration",
-        "dizziness", "fainting", "persistent vomiting", "blood in stool",
-        "severe headache", "pain not improving"
-    ]
-
-    triggered_urgent = [uk for uk in urgent_keywords if uk in cc or any(uk in s for s in assoc)]
+    triggered_urgent = URGENT_KEYWORDS.find(texts)
     if triggered_urgent:
         joined_urgent = ", ".join(triggered_urgent)
         return {
@@ -76,3 +114,101 @@ def evaluate_triage(struct):
         "level": "Routine",
         "reason": "🟢 No red flags found; symptoms appear non-urgent."
     }
+
+
+def _critical_vitals(hr, sbp, temp):
+    if hr and hr > 130:
+        return {"level": "Emergency", "reason": "⚠️ Very high heart rate (>130 bpm) — possible tachycardia."}
+    if sbp and sbp < 90:
+        return {"level": "Emergency", "reason": "⚠️ Critically low blood pressure (<90 mmHg)."}
+    if temp and temp >= 40:
+        return {"level": "Emergency", "reason": "⚠️ Extremely high fever (≥40°C)."}
+    return None
+
+
+# -------------------------
+# ⚡ Raw-message fast path
+# -------------------------
+# Runs on the patient's own words before any LLM call, so an emergency is
+# recognised in microseconds. Only ever escalates; the full pipeline still runs.
+# A cue negates a red flag only when it directly governs it ("no chest pain",
+# "denies any chest pain"): at most two filler words in between. Anything looser
+# ("never had chest pain this bad", "can not stop the chest pain") still escalates.
+_NEGATION = re.compile(
+    r"\b(?:no|not|denies|deny|denied|without|negative for|(?:do|does|did)(?:n'?t| not) have)\s+"
+    r"(?:(?:any|a|an|more|further|signs? of|symptoms? of|history of)\s+){0,2}$",
+    re.IGNORECASE,
+)
+_LINK = r"(?:\s+(?:is|was|of|at|around|about))?\s*[:=]?\s*"
+_HR = re.compile(rf"\b(?:hr|heart rate|pulse)(?:\s+rate)?{_LINK}(\d{{2,3}})\b", re.IGNORECASE)
+_BP = re.compile(rf"\b(?:bp|blood pressure){_LINK}(\d{{2,3}})\s*/\s*\d{{2,3}}\b", re.IGNORECASE)
+_TEMP = re.compile(rf"\b(?:temp|temperature|fever){_LINK}(\d{{2,3}}(?:\.\d+)?)\s*(?:°\s*)?([cf])?\b", re.IGNORECASE)
+
+ESCALATION_TEMPLATE = (
+    "⚠️ {what} can be a sign of a medical emergency. "
+    "Please call your local emergency number or go to the nearest emergency department now. "
+    "Do not drive yourself, and stay with someone if you can."
+)
+
+
+def _negated(text, start):
+    """True when the hit at `start` directly follows a negation cue ("no chest pain")."""
+    return bool(_NEGATION.search(text[max(0, start - 60):start]))
+
+
+def _message_vitals(text):
+    hr, sbp, temp = _HR.search(text), _BP.search(text), _TEMP.search(text)
+    t = float(temp.group(1)) if temp else 0.0
+    # "temp 104" or "104 F" is Fahrenheit
+    if temp and ((temp.group(2) or "").lower() == "f" or (not temp.group(2) and t > 45)):
+        t = (t - 32) * 5 / 9
+    return (int(hr.group(1)) if hr else 0), (int(sbp.group(1)) if sbp else 0), t
+
+
+def affirmed_red_flags(texts):
+    """Red flags mentioned in any of `texts` and not negated ("no chest pain"), in table order."""
+    flags = set()
+    for text in texts:
+        flags.update(keyword for keyword, start in RED_FLAGS.spans(text) if not _negated(text, start))
+    return sorted(flags, key=RED_FLAGS._order.get)
+
+
+def scan_message(text):
+    """
+    Red-flag keywords and critical vitals in one raw patient message.
+    Returns an Emergency triage dict (with "flags") or None. Negated mentions are ignored.
+    """
+    flags = affirmed_red_flags([text])
+    if flags:
+        return {
+            "level": "Emergency",
+            "reason": f"⚠️ Red flag symptoms detected ({', '.join(flags)}). Immediate medical attention required.",
+            "flags": flags,
+        }
+    critical = _critical_vitals(*_message_vitals(text))
+    if critical:
+        return dict(critical, flags=[])
+    return None
+
+
+def escalation_text(alert):
+    """Templated advice shown while the doctor reply is still being generated."""
+    if alert.get("flags"):
+        what = f"What you describe ({', '.join(alert['flags'])})"
+    else:
+        what = "The reading you reported"
+    return ESCALATION_TEMPLATE.format(what=what)
+
+
+def evaluate_triage_batch(records):
+    """
+    Triage many structured records in one call (e.g. nightly re-triage of history).
+    Returns one result per record, in order; malformed records are reported, not raised.
+    """
+    results = []
+    for struct in records:
+        try:
+            results.append(evaluate_triage(struct))
+        except Exception as e:
+            results.append({"level": "Routine", "reason": f"⚠️ Could not evaluate record: {e}", "error": True})
+    return results
@@ -1,17 +1,63 @@
 # utils.py
-import os, json
+import os
 from dotenv import load_dotenv
 load_dotenv()
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 MODEL_NAME = os.getenv("MODEL_NAME", "mistral:latest")
+REPORT_MODEL_NAME = os.getenv("REPORT_MODEL_NAME", "mistral:latest")  # summary + diagnosis
 APP_PORT = int(os.getenv("APP_PORT", 8000))
 
-# simple logger
-def log_session(session_id, data):
-    import time, os
-    os.makedirs("logs", exist_ok=True)
-    ts = time.strftime("%Y%m%d-%H%M%S")
-    filename = f"logs/{session_id}-{ts}.json"
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# shared Ollama client; concurrency is per Ollama endpoint (see llm_client.py)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 8))
+# several Ollama servers as "url=model|model,url" (no "=" serves every model); empty -> OLLAMA_URL (see llm_router.py)
+OLLAMA_ENDPOINTS = os.getenv("OLLAMA_ENDPOINTS", "")
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", 10.0))  # seconds
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", 3))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", 15.0))  # seconds
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", 2))  # extra attempts on other nodes
+# how long Ollama keeps a model loaded after each call; -1 pins it (sent with every request + the startup preload)
+_keep_alive = os.getenv("LLM_KEEP_ALIVE", "-1")
+LLM_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+# per-model caps per endpoint as "model=n,model=n" and the queue length past which non-emergency work gets 429 (see llm_scheduler.py)
+LLM_MODEL_LIMITS = os.getenv("LLM_MODEL_LIMITS", "")
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", 64))
+# live | record | replay — record/replay go through a cassette file (see llm_cassette.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live")
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "data/llm_cassette.jsonl.gz")
+LLM_REPLAY_LATENCY_MS = os.getenv("LLM_REPLAY_LATENCY_MS", "0")  # milliseconds, or "recorded"
+
+# per-agent Ollama generation settings, sent as real `options` (see llm_client._apply_profile)
+GENERATION_PROFILES = {
+    "doctor": {"options": {"num_predict": 160, "temperature": 0.25,
+                           "stop": ["\nUser:", "\nPatient:", "\nAssistant:", "\nDoctor:"]}},
+    "extractor": {"options": {"num_predict": 300, "temperature": 0}, "format": "json"},
+    "summary": {"options": {"num_predict": 600, "temperature": 0.2}},
+    "diagnosis": {"options": {"num_predict": 400, "temperature": 0.2}},
+    "report": {"options": {"num_predict": 1000, "temperature": 0.2}, "format": "json"},
+    "digest": {"options": {"num_predict": 200, "temperature": 0}},
+}
+
+# long consultations: digest of older turns + the last K verbatim once over budget (see history_manager.py)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", 6))
+HISTORY_FOLD_BATCH = int(os.getenv("HISTORY_FOLD_BATCH", 4))
+
+# only send new turns + the previous record to the extractor (see symptom_extractor.extract_incremental)
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION", "1") == "1"
+
+# in-memory chat sessions (see session_store.py)
+SESSION_MAX = int(os.getenv("SESSION_MAX", 1000))
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", 3600))  # seconds
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 200))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 256_000))
+
+# summary / diagnosis results, keyed by conversation hash (see result_cache.py)
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", 256))
+
+# append-only session log (see session_log.py)
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))  # seconds
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 256))
+LOG_SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MAX_BYTES", 64 * 1024 * 1024))
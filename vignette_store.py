@@ -0,0 +1,155 @@
+# vignette_store.py
+"""
+Append-only vignette store: one JSON record per line in data/vignettes.jsonl,
+plus data/vignettes.jsonl.idx holding the byte offset of every line (uint64).
+Random access is one seek + read; appends never rewrite existing data.
+
+Bulk-generate a synthetic cohort across processes:
+    python vignette_store.py generate -n 1000000 -p 8
+"""
+import argparse, json, os, random
+from array import array
+from multiprocessing import Pool
+
+VIGNETTES_STORE = "data/vignettes.jsonl"
+
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class VignetteStore:
+    """
+    Offsets live in memory (8 bytes per vignette). If the process died between the
+    data and index writes, the missing tail is re-indexed on open; a torn last
+    line is truncated away.
+    """
+
+    def __init__(self, path=VIGNETTES_STORE):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._offsets = array("Q")
+        self._end = 0  # byte offset just past the last complete line
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        rewrite = False
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            whole = len(data) - len(data) % self._offsets.itemsize
+            rewrite = whole != len(data)  # torn index entry
+            self._offsets.frombytes(data[:whole])
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.path, "ab+") as f:
+            if self._offsets and self._offsets[-1] >= size:
+                self._offsets = array("Q")  # index from another file — rebuild
+                rewrite = True
+            start = 0
+            if self._offsets:
+                f.seek(self._offsets[-1])
+                f.readline()
+                start = f.tell()
+            self._end = start
+            f.seek(start)
+            added = array("Q")
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    break  # torn write
+                added.append(self._end)
+                self._end += len(line)
+        self._offsets.extend(added)
+        if rewrite:
+            self._write_index(self._offsets, rewrite=True)
+        elif added:
+            self._write_index(added)
+        if size > self._end:
+            os.truncate(self.path, self._end)
+
+    def _write_index(self, offsets, rewrite=False):
+        with open(self.index_path, "wb" if rewrite else "ab") as f:
+            offsets.tofile(f)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def append(self, record):
+        """Append one vignette; returns its index."""
+        return self.append_encoded([_encode(record)])
+
+    def append_many(self, records):
+        return self.append_encoded([_encode(r) for r in records])
+
+    def append_encoded(self, lines):
+        """Append pre-serialised JSONL lines; returns the index of the first one."""
+        first = len(self._offsets)
+        added = array("Q")
+        pos = self._end
+        for line in lines:
+            added.append(pos)
+            pos += len(line)
+        with open(self.path, "ab") as f:
+            f.write(b"".join(lines))
+        # data first, then index: a crash in between is repaired on the next open
+        self._write_index(added)
+        self._offsets.extend(added)
+        self._end = pos
+        return first
+
+    def get(self, i):
+        start = self._offsets[i]
+        end = self._offsets[i + 1] if i + 1 < len(self._offsets) else self._end
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def sample(self, k=None, rng=random):
+        """One random vignette (or a list of k, without replacement), without loading the file."""
+        if k is None:
+            return self.get(rng.randrange(len(self._offsets)))
+        return [self.get(i) for i in rng.sample(range(len(self._offsets)), k)]
+
+    def __iter__(self):
+        """Stream vignettes in insertion order."""
+        with open(self.path, "rb") as f:
+            for _ in range(len(self._offsets)):
+                yield json.loads(f.readline())
+
+
+def _generate_chunk(args):
+    """Worker: (seed, first_id, count) -> serialised lines. Runs in a child process."""
+    from patient_simulator import random_patient
+    seed, first_id, count = args
+    rng = random.Random(seed)
+    return [_encode(random_patient(rng, first_id + i)) for i in range(count)]
+
+
+def bulk_generate(n, store_path=VIGNETTES_STORE, processes=None, chunk_size=10000, seed=0):
+    """
+    Append n synthetic vignettes, generated in parallel. Workers only build bytes;
+    this process is the single writer, so chunks land in order with sequential ids.
+    """
+    store = VignetteStore(store_path)
+    base = len(store)
+    jobs = [(seed * 1_000_003 + k, base + k * chunk_size, min(chunk_size, n - k * chunk_size))
+            for k in range((n + chunk_size - 1) // chunk_size)]
+    with Pool(processes) as pool:
+        for lines in pool.imap(_generate_chunk, jobs):
+            store.append_encoded(lines)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vignette store tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    gen = sub.add_parser("generate", help="append synthetic vignettes")
+    gen.add_argument("-n", type=int, required=True)
+    gen.add_argument("-p", "--processes", type=int, default=None)
+    gen.add_argument("--chunk-size", type=int, default=10000)
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--store", default=VIGNETTES_STORE)
+    args = parser.parse_args()
+
+    store = bulk_generate(args.n, args.store, args.processes, args.chunk_size, args.seed)
+    print(f"✅ {len(store)} vignettes in {args.store}")